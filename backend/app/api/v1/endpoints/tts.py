@@ -1,10 +1,12 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, File, UploadFile, Request
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Request
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from typing import Callable, Optional, List
 import os
+import asyncio
 import logging
-from datetime import datetime
+import itertools
+import time
 import uuid
 
 from app.schemas.tts import (
@@ -13,7 +15,9 @@ from app.schemas.tts import (
 )
 from app.services.tts_service import tts_service
 from app.utils.audio_utils import format_file_size
-from app.core.database import get_db
+from app.utils.streaming import SlotStreamingResponse
+from app.core.config import settings
+from app.core.database import get_session_factory
 from app.core.auth import get_current_user_optional, check_request_rate_limit
 from app.models.user import User
 from app.models.tts_history import TTSHistory
@@ -21,15 +25,18 @@ from app.models.tts_history import TTSHistory
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# 流式文件名时间戳缓存（秒, 格式化字符串）和同秒序号
+_ts_cache = (0, "")
+_stream_counter = itertools.count()
+
 
 @router.post("/synthesize", response_model=TTSResponse, summary="同步语音合成")
 async def synthesize_text(
     request: TTSRequest,
-    background_tasks: BackgroundTasks,
     http_request: Request,
     current_user: Optional[User] = Depends(get_current_user_optional),
     rate_limit_check = Depends(check_request_rate_limit),
-    db: Session = Depends(get_db)
+    db_factory: Callable[[], Session] = Depends(get_session_factory)
 ):
     """
     同步语音合成接口
@@ -46,68 +53,36 @@ async def synthesize_text(
     
     返回合成结果信息，包含文件路径和下载链接
     """
+    user_id = current_user.id if current_user else None
+    history = None
+    
     try:
-        user_id = current_user.id if current_user else None
         logger.info(f"收到语音合成请求: 用户={user_id or '匿名'}, 文本长度={len(request.text)}, 音色={request.voice_id}")
         
-        # 创建历史记录
+        # 创建历史记录（仅在内存中，成功后由后台队列批量写入数据库）
         request_id = str(uuid.uuid4())
-        history = TTSHistory(
-            request_id=request_id,
-            user_id=user_id,
-            text=request.text,
-            text_length=len(request.text),
-            voice_id=request.voice_id,
-            speed=request.speed,
-            volume=request.volume,
-            pitch=request.pitch,
-            format=request.format,
-            emotion=request.emotion,
-            ip_address=getattr(http_request.client, 'host', None),
-            user_agent=http_request.headers.get("user-agent")
-        )
-        
-        db.add(history)
-        db.commit()
-        db.refresh(history)
-        
-        # 标记开始处理
-        history.mark_started()
-        db.commit()
+        if current_user or settings.PERSIST_ANONYMOUS_HISTORY:
+            history = _build_history(request, request_id, user_id, http_request)
+            history.mark_started()
         
-        # 执行语音合成
-        response = await tts_service.synthesize_text(request, str(user_id) if user_id else None)
+        # 执行语音合成（相同请求直接复用已合成的音频）
+        response = await _synthesize_limited(request, user_id, http_request.app.state.tts_sem)
         
-        # 更新历史记录
-        file_info = {
-            "file_path": response.file_path,
-            "file_url": response.file_url,
-            "file_size": response.file_size,
-            "audio_duration": response.duration
-        }
-        history.mark_completed(file_info)
+        if history is not None:
+            history.mark_completed(_build_file_info(response))
         
-        # 计算消耗
-        cost = history.calculate_cost()
-        
-        # 更新用户统计
-        if current_user:
-            current_user.increment_usage(len(request.text), response.duration)
-        
-        # 提交所有更改到数据库
-        db.commit()
-        
-        # 添加后台任务
-        background_tasks.add_task(log_synthesis_stats, request, response, current_user)
+        await http_request.app.state.stats_queue.put(
+            _build_stats_item(request, response, request_id, user_id, history)
+        )
         
-        logger.info(f"语音合成成功: {response.request_id}, 消耗积分: {cost}")
+        logger.info(f"语音合成成功: {response.request_id}")
         return response
         
     except Exception as e:
-        # 标记失败
-        if 'history' in locals():
+        # 失败记录直接写入，仅失败时占用数据库连接
+        if history is not None:
             history.mark_failed(str(e))
-            db.commit()
+            _save_histories(db_factory, [history])
         
         logger.error(f"语音合成失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"语音合成失败: {str(e)}")
@@ -116,6 +91,7 @@ async def synthesize_text(
 @router.post("/synthesize/stream", summary="流式语音合成")
 async def synthesize_stream(
     request: TTSStreamRequest,
+    http_request: Request,
     user_id: Optional[str] = None
 ):
     """
@@ -128,48 +104,207 @@ async def synthesize_stream(
     
     响应为音频流，可直接播放或保存
     """
+    # 在返回响应前占用并发名额，排队超时直接返回503而不是中断的200
+    sem = http_request.app.state.tts_sem
+    try:
+        await asyncio.wait_for(sem.acquire(), timeout=settings.SYNTHESIS_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="语音合成服务繁忙，请稍后重试")
+    
     try:
         logger.info(f"收到流式合成请求: 文本长度={len(request.text)}, 音色={request.voice_id}")
         
-        async def generate_audio():
-            async for chunk in tts_service.synthesize_stream(request):
-                yield chunk
-        
         # 生成文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"tts_stream_{timestamp}.{request.format}"
+        filename = f"tts_stream_{_ts()}_{next(_stream_counter)}.{request.format}"
         
-        return StreamingResponse(
-            generate_audio(),
+        # 名额由响应在结束或客户端断开时释放
+        return SlotStreamingResponse(
+            tts_service.synthesize_stream(request),
+            semaphore=sem,
             media_type=f"audio/{request.format}",
             headers={
                 "Content-Disposition": f"attachment; filename={filename}",
-                "X-Synthesis-Info": f"text_length={len(request.text)};voice={request.voice_id}"
+                "X-Synthesis-Info": f"text_length={len(request.text)};voice={request.voice_id}",
+                "X-Accel-Buffering": "no"  # 禁止反向代理缓冲，音频块即时转发
             }
         )
         
     except Exception as e:
+        sem.release()
         logger.error(f"流式语音合成失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"流式语音合成失败: {str(e)}")
 
 
+@router.post("/batch", response_model=BatchTTSResponse, summary="批量语音合成")
+async def synthesize_batch(
+    request: BatchTTSRequest,
+    http_request: Request,
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    rate_limit_check = Depends(check_request_rate_limit),
+    db_factory: Callable[[], Session] = Depends(get_session_factory)
+):
+    """
+    批量语音合成接口
+    
+    - **items**: 合成请求列表，每项参数同 /synthesize
+    
+    各项在并发限制内同时合成，内容相同的项只合成一次。
+    单项失败不影响其他项，失败信息在 errors 中返回
+    """
+    user_id = current_user.id if current_user else None
+    
+    try:
+        logger.info(f"收到批量合成请求: 用户={user_id or '匿名'}, 数量={len(request.items)}")
+        
+        # 创建各项历史记录（仅在内存中）
+        request_ids = [str(uuid.uuid4()) for _ in request.items]
+        histories = [None] * len(request.items)
+        if current_user or settings.PERSIST_ANONYMOUS_HISTORY:
+            histories = [
+                _build_history(item, request_id, user_id, http_request)
+                for item, request_id in zip(request.items, request_ids)
+            ]
+            for history in histories:
+                history.mark_started()
+        
+        # 按内容哈希去重后并发合成
+        keys = [tts_service.generate_cache_key(item) for item in request.items]
+        unique_items = dict(zip(keys, request.items))
+        sem = http_request.app.state.tts_sem
+        outcomes = await asyncio.gather(
+            *(_synthesize_limited(item, user_id, sem) for item in unique_items.values()),
+            return_exceptions=True
+        )
+        outcome_by_key = dict(zip(unique_items, outcomes))
+        
+        results = []
+        errors = []
+        failed_histories = []
+        for index, (item, key, request_id, history) in enumerate(
+            zip(request.items, keys, request_ids, histories)
+        ):
+            outcome = outcome_by_key[key]
+            if isinstance(outcome, Exception):
+                if history is not None:
+                    history.mark_failed(str(outcome))
+                    failed_histories.append(history)
+                errors.append({"index": index, "voice_id": item.voice_id, "error": str(outcome)})
+            else:
+                if history is not None:
+                    history.mark_completed(_build_file_info(outcome))
+                results.append(outcome)
+                await http_request.app.state.stats_queue.put(
+                    _build_stats_item(item, outcome, request_id, user_id, history)
+                )
+        
+        # 失败记录一次性写入
+        if failed_histories:
+            _save_histories(db_factory, failed_histories)
+        
+        logger.info(f"批量合成完成: 成功={len(results)}, 失败={len(errors)}")
+        return BatchTTSResponse(
+            batch_id=str(uuid.uuid4()),
+            total_count=len(request.items),
+            success_count=len(results),
+            failed_count=len(errors),
+            results=results,
+            errors=errors
+        )
+        
+    except Exception as e:
+        logger.error(f"批量语音合成失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"批量语音合成失败: {str(e)}")
+
+
 # 继续剩余的接口...
 
-# 后台任务函数
-async def log_synthesis_stats(request: TTSRequest, response: TTSResponse):
-    """记录合成统计信息"""
+
+# 辅助函数
+def _ts() -> str:
+    """返回当前时间戳字符串，同一秒内复用已格式化的结果"""
+    global _ts_cache
+    now = int(time.time())
+    if _ts_cache[0] != now:
+        _ts_cache = (now, time.strftime("%Y%m%d_%H%M%S", time.localtime(now)))
+    return _ts_cache[1]
+
+
+def _build_history(
+    request: TTSRequest,
+    request_id: str,
+    user_id: Optional[int],
+    http_request: Request
+) -> TTSHistory:
+    """根据合成请求创建历史记录"""
+    return TTSHistory(
+        request_id=request_id,
+        user_id=user_id,
+        text=request.text,
+        text_length=len(request.text),
+        voice_id=request.voice_id,
+        speed=request.speed,
+        volume=request.volume,
+        pitch=request.pitch,
+        format=request.format,
+        emotion=request.emotion,
+        ip_address=getattr(http_request.client, 'host', None),
+        user_agent=http_request.headers.get("user-agent")
+    )
+
+
+async def _synthesize_limited(
+    request: TTSRequest,
+    user_id: Optional[int],
+    sem: asyncio.Semaphore
+) -> TTSResponse:
+    """在并发限制和超时内执行合成（名额在服务内确认需要调用火山引擎后才占用）"""
     try:
-        stats = {
-            "request_id": response.request_id,
-            "text_length": len(request.text),
-            "voice_id": request.voice_id,
-            "file_size": response.file_size,
-            "duration": response.duration,
-            "synthesis_time": response.synthesis_time,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        logger.info(f"合成统计: {stats}")
-        
+        return await asyncio.wait_for(
+            tts_service.synthesize_text(request, str(user_id) if user_id else None, semaphore=sem),
+            timeout=settings.SYNTHESIS_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise Exception(f"语音合成超时（{settings.SYNTHESIS_TIMEOUT}秒）")
+
+
+def _build_file_info(response: TTSResponse) -> dict:
+    """从合成结果提取历史记录所需的文件信息"""
+    return {
+        "file_path": response.file_path,
+        "file_url": response.file_url,
+        "file_size": response.file_size,
+        "audio_duration": response.duration
+    }
+
+
+def _build_stats_item(
+    request: TTSRequest,
+    response: TTSResponse,
+    request_id: str,
+    user_id: Optional[int],
+    history: Optional[TTSHistory] = None
+) -> dict:
+    """构建后台统计队列条目（history 为待写入的历史记录，可为空）"""
+    return {
+        "request_id": request_id,
+        "user_id": user_id,
+        "history": history,
+        "voice_id": request.voice_id,
+        "text_length": len(request.text),
+        "file_size": response.file_size,
+        "duration": response.duration,
+        "synthesis_time": response.synthesis_time
+    }
+
+
+def _save_histories(db_factory: Callable[[], Session], histories: List[TTSHistory]):
+    """直接写入历史记录（用于失败记录）"""
+    db = db_factory()
+    try:
+        db.add_all(histories)
+        db.commit()
     except Exception as e:
-        logger.error(f"记录统计失败: {str(e)}")
\ No newline at end of file
+        db.rollback()
+        logger.error(f"保存合成历史失败: {str(e)}")
+    finally:
+        db.close()
@@ -32,42 +32,22 @@ async def get_voice_list(
         # 获取基础音色列表
         voice_list = await tts_service.get_voice_list(category)
         
-        # 应用过滤条件
+        # 应用过滤条件（先通过索引求出匹配的音色ID，再按分类重组）
         if language or emotion_support is not None or search:
+            voice_ids = await tts_service.get_voice_ids(category, language, emotion_support, search)
             filtered_categories = []
             
+            # 音色列表为共享缓存对象，构建新对象而不是原地修改
             for cat in voice_list.categories:
-                filtered_voices = []
-                
-                for voice in cat.voices:
-                    # 语言过滤
-                    if language and language not in voice.language:
-                        continue
-                    
-                    # 情感支持过滤
-                    if emotion_support is not None:
-                        has_emotion = voice.emotions is not None and len(voice.emotions) > 0
-                        if emotion_support and not has_emotion:
-                            continue
-                        if not emotion_support and has_emotion:
-                            continue
-                    
-                    # 搜索过滤
-                    if search:
-                        search_text = search.lower()
-                        if (search_text not in voice.name.lower() and 
-                            search_text not in voice.description.lower() and
-                            search_text not in ' '.join(voice.tags).lower()):
-                            continue
-                    
-                    filtered_voices.append(voice)
+                filtered_voices = [voice for voice in cat.voices if voice.id in voice_ids]
                 
                 if filtered_voices:
-                    cat.voices = filtered_voices
-                    filtered_categories.append(cat)
+                    filtered_categories.append(cat.model_copy(update={"voices": filtered_voices}))
             
-            voice_list.categories = filtered_categories
-            voice_list.total_count = sum(len(cat.voices) for cat in filtered_categories)
+            voice_list = voice_list.model_copy(update={
+                "categories": filtered_categories,
+                "total_count": sum(len(cat.voices) for cat in filtered_categories)
+            })
         
         logger.info(f"返回音色列表: {voice_list.total_count}个音色，{len(voice_list.categories)}个分类")
         return voice_list
@@ -113,27 +93,7 @@ async def get_voice_statistics():
     try:
         logger.info("获取音色库统计信息")
         
-        voice_list = await tts_service.get_voice_list()
-        
-        # 统计基础信息
-        total_voices = voice_list.total_count
-        total_categories = len(voice_list.categories)
-        emotion_voice_count = len(voice_list.emotion_voices)
-        
-        return {
-            "summary": {
-                "total_voices": total_voices,
-                "total_categories": total_categories,
-                "emotion_voices": emotion_voice_count,
-                "supported_languages": 4,  # 中英日西
-                "supported_emotions": 9
-            },
-            "metadata": {
-                "version": "2.0.0",
-                "last_updated": "2024-06-04",
-                "source": "voice_presets_complete.json"
-            }
-        }
+        return await tts_service.get_voice_statistics()
         
     except Exception as e:
         logger.error(f"获取音色库统计失败: {str(e)}")
@@ -31,6 +31,7 @@ class Settings(BaseSettings):
     DATABASE_URL: Optional[str] = None
     DATABASE_POOL_SIZE: int = 10
     DATABASE_MAX_OVERFLOW: int = 20
+    DATABASE_QUERY_CACHE_SIZE: int = 1200  # SQL编译缓存条目数
     
     # Redis配置
     REDIS_URL: str = "redis://localhost:6379/0"
@@ -38,7 +39,7 @@ class Settings(BaseSettings):
     REDIS_DB: int = 0
     
     # 缓存配置
-    CACHE_ENABLED: bool = False  # 临时禁用缓存
+    CACHE_ENABLED: bool = True
     CACHE_TTL: int = 3600  # 缓存过期时间（秒）
     CACHE_MAX_SIZE: int = 1000  # 最大缓存条目数
     CACHE_EXPIRE_SECONDS: int = 3600  # 兼容性保留
@@ -54,6 +55,7 @@ class Settings(BaseSettings):
     # 用户认证配置
     AUTH_ENABLED: bool = False  # 是否启用认证（默认关闭）
     ALLOW_ANONYMOUS: bool = True  # 是否允许匿名用户
+    PERSIST_ANONYMOUS_HISTORY: bool = True  # 是否保存匿名用户的合成历史
     DEFAULT_USER_QUOTA: int = 1000  # 默认用户每日配额
     REQUIRE_EMAIL_VERIFICATION: bool = False  # 是否需要邮箱验证
     
@@ -74,7 +76,7 @@ class Settings(BaseSettings):
     
     def _load_volcano_config(self):
         """从tts_config.json加载火山引擎配置"""
-        import json
+        import orjson
         try:
             # 查找config文件
             config_paths = [
@@ -87,8 +89,8 @@ class Settings(BaseSettings):
             config_data = None
             for path in config_paths:
                 try:
-                    with open(path, 'r', encoding='utf-8') as f:
-                        config_data = json.load(f)
+                    with open(path, 'rb') as f:
+                        config_data = orjson.loads(f.read())
                     print(f"✅ 从 {path} 加载火山引擎配置")
                     break
                 except FileNotFoundError:
@@ -102,13 +104,21 @@ class Settings(BaseSettings):
             else:
                 print("⚠️ 未找到tts_config.json文件，使用环境变量配置")
                 
+        except orjson.JSONDecodeError as e:
+            print(f"❌ tts_config.json解析失败: {e}")
+            print("📝 请确保tts_config.json文件格式正确")
         except Exception as e:
             print(f"❌ 加载火山引擎配置失败: {e}")
-            print("📝 请确保tts_config.json文件格式正确")
     
     # 文件存储配置
     AUDIO_FILES_PATH: str = "./audio_files"
+    # 音色试听音频目录（由项目根目录下的试听生成脚本写入）
+    PREVIEW_FILES_PATH: str = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "..", "..", "..", "audio_files", "previews")
+    )
     TEMP_FILES_PATH: str = "./temp_files"
+    # 音色配置文件voice_presets_complete.json路径（未设置时自动查找）
+    VOICE_PRESETS_PATH: Optional[str] = None
     MAX_FILE_SIZE_MB: int = 100
     AUDIO_FILE_EXPIRE_HOURS: int = 24
     
@@ -142,5 +152,6 @@ settings = Settings()
 
 # 确保必要的目录存在
 os.makedirs(settings.AUDIO_FILES_PATH, exist_ok=True)
+os.makedirs(settings.PREVIEW_FILES_PATH, exist_ok=True)
 os.makedirs(settings.TEMP_FILES_PATH, exist_ok=True)
 os.makedirs(os.path.dirname(settings.LOG_FILE), exist_ok=True)
\ No newline at end of file
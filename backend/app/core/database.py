@@ -44,6 +44,7 @@ def create_database_engine():
             max_overflow=settings.DATABASE_MAX_OVERFLOW,
             pool_pre_ping=True,
             pool_recycle=3600,
+            query_cache_size=settings.DATABASE_QUERY_CACHE_SIZE,
             echo=settings.DEBUG,
             connect_args={
                 "options": "-c timezone=UTC"
@@ -55,10 +56,13 @@ def create_database_engine():
         # SQLite配置
         engine = create_engine(
             database_url,
+            query_cache_size=settings.DATABASE_QUERY_CACHE_SIZE,
             echo=settings.DEBUG,
             connect_args={
                 "check_same_thread": False,
-                "timeout": 30
+                "timeout": 30,  # 锁等待时间（秒），即busy_timeout，不再另设PRAGMA以免覆盖
+                # 关闭驱动自带的隐式事务，由SQLAlchemy显式管理
+                "isolation_level": None
             }
         )
         logger.info("使用SQLite数据库")
@@ -70,9 +74,15 @@ def create_database_engine():
             cursor.execute("PRAGMA foreign_keys=ON")
             cursor.execute("PRAGMA journal_mode=WAL")
             cursor.execute("PRAGMA synchronous=NORMAL")
-            cursor.execute("PRAGMA cache_size=10000")
+            cursor.execute("PRAGMA cache_size=-65536")  # 64MB
             cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+            cursor.execute("PRAGMA wal_autocheckpoint=1000")
             cursor.close()
+        
+        @event.listens_for(engine, "begin")
+        def do_begin(conn):
+            conn.exec_driver_sql("BEGIN")
     
     else:
         raise ValueError(f"不支持的数据库类型: {database_url}")
@@ -112,6 +122,14 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+def get_session_factory() -> sessionmaker:
+    """获取数据库会话工厂（依赖注入用，由调用方按需创建和关闭会话）"""
+    if not SessionLocal:
+        create_session_maker()
+    
+    return SessionLocal
+
+
 def create_tables():
     """创建所有数据表"""
     try:
@@ -221,8 +239,7 @@ async def init_default_data():
             admin_user.set_password("admin123")
             
             db.add(admin_user)
-            db.commit()
-            db.refresh(admin_user)
+            db.flush()
             
             logger.info(f"✅ 创建默认管理员用户: {admin_user.username}")
         
@@ -243,11 +260,12 @@ async def init_default_data():
             demo_user.set_password("demo123")
             
             db.add(demo_user)
-            db.commit()
-            db.refresh(demo_user)
+            db.flush()
             
             logger.info(f"✅ 创建默认演示用户: {demo_user.username}")
         
+        # 默认用户一次性提交
+        db.commit()
         db.close()
         
     except Exception as e:
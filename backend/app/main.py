@@ -1,11 +1,14 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 import time
+import asyncio
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from contextlib import asynccontextmanager
-import os
+from typing import List, Tuple
 
 from app.core.config import settings
 from app.api.v1.api import api_router
@@ -23,9 +26,33 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def start_queue_logging() -> Tuple[QueueListener, List[logging.Handler]]:
+    """
+    服务运行期间改为队列日志：记录时只入队，由后台线程写入文件和控制台
+    
+    Returns:
+        日志监听器和原有的根日志处理器（关闭时恢复）
+    """
+    root_logger = logging.getLogger()
+    original_handlers = root_logger.handlers[:]
+    
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *original_handlers, respect_handler_level=True)
+    listener.start()
+    root_logger.handlers = [QueueHandler(log_queue)]
+    return listener, original_handlers
+
+
+def stop_queue_logging(listener: QueueListener, original_handlers: List[logging.Handler]):
+    """恢复原有的根日志处理器，并写完队列中剩余的日志"""
+    logging.getLogger().handlers = original_handlers
+    listener.stop()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
+    log_listener, original_log_handlers = start_queue_logging()
     logger.info("🚀 TTS API服务启动中...")
     
     # 启动时的初始化操作
@@ -38,6 +65,16 @@ async def lifespan(app: FastAPI):
         from app.services.cache_service import cache_service
         await cache_service.initialize()
         
+        # 限制同时进行的语音合成数量
+        app.state.tts_sem = asyncio.Semaphore(settings.MAX_CONCURRENT_SYNTHESIS)
+        
+        # 启动合成统计后台队列
+        from app.services.stats_service import drain_stats
+        app.state.stats_queue = asyncio.Queue()
+        app.state.stats_worker = asyncio.create_task(
+            drain_stats(app.state.stats_queue, db_manager.session_factory)
+        )
+        
         logger.info("✅ 服务初始化完成")
         yield
     finally:
@@ -45,9 +82,19 @@ async def lifespan(app: FastAPI):
         from app.services.cache_service import cache_service
         from app.core.database import db_manager
         
+        # 写完队列中剩余的统计后停止后台任务
+        stats_worker = getattr(app.state, "stats_worker", None)
+        if stats_worker:
+            try:
+                await asyncio.wait_for(app.state.stats_queue.join(), timeout=10)
+            except asyncio.TimeoutError:
+                logger.warning("合成统计队列未能在关闭前写完")
+            stats_worker.cancel()
+        
         await cache_service.close()
         await db_manager.close()
         logger.info("👋 TTS API服务关闭")
+        stop_queue_logging(log_listener, original_log_handlers)
 
 
 # 创建FastAPI应用
@@ -58,6 +105,7 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
     openapi_url="/openapi.json",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -70,15 +118,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 静态文件服务
-app.mount("/audio", StaticFiles(directory=settings.AUDIO_FILES_PATH), name="audio")
-
-# 创建预览文件夹（如果不存在）
-previews_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "audio_files", "previews")
-os.makedirs(previews_dir, exist_ok=True)
+# 静态文件服务（目录已在配置加载时创建）
+app.mount("/audio", StaticFiles(directory=settings.AUDIO_FILES_PATH, check_dir=False), name="audio")
 
 # 挂载静态文件（预览音频）
-app.mount("/previews", StaticFiles(directory=previews_dir), name="previews")
+app.mount("/previews", StaticFiles(directory=settings.PREVIEW_FILES_PATH, check_dir=False), name="previews")
 
 # 请求日志中间件
 @app.middleware("http")
@@ -130,10 +174,12 @@ async def health_check():
         "service": "tts-api"
     }
 
-# 详细健康检查
-@app.get("/health/detailed")
-async def detailed_health_check():
-    """详细健康检查，包含各个组件状态"""
+# 详细健康检查结果缓存（生成时间, 状态）
+_health_cache: tuple = (0.0, {})
+
+
+def _build_health_status() -> dict:
+    """生成详细健康检查状态"""
     status = {
         "status": "healthy",
         "timestamp": time.time(),
@@ -152,7 +198,23 @@ async def detailed_health_check():
     return status
 
 
+# 详细健康检查
+@app.get("/health/detailed")
+async def detailed_health_check():
+    """详细健康检查，包含各个组件状态（结果缓存1秒）"""
+    global _health_cache
+    now = time.time()
+    cached_at, status = _health_cache
+    if now - cached_at >= 1.0:
+        status = _build_health_status()
+        _health_cache = (now, status)
+    
+    # 时间戳每次返回最新值
+    return {**status, "timestamp": now}
+
+
 if __name__ == "__main__":
+    import sys
     import uvicorn
     uvicorn.run(
         "app.main:app",
@@ -160,5 +222,8 @@ if __name__ == "__main__":
         port=settings.PORT,
         reload=settings.DEBUG,
         log_level=settings.LOG_LEVEL.lower(),
-        workers=1 if settings.DEBUG else settings.WORKERS
+        workers=1 if settings.DEBUG else settings.WORKERS,
+        # uvloop不支持Windows（uvloop和httptools由uvicorn[standard]提供）
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools"
     )
\ No newline at end of file
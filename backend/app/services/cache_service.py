@@ -1,10 +1,14 @@
 import asyncio
-import json
+import fnmatch
+import orjson
 import hashlib
-import pickle
-from typing import Optional, Any, Dict
+import heapq
+import re
+import sys
+import time
+from collections import OrderedDict
+from typing import Optional, Any, Dict, List, Tuple
 import logging
-from datetime import datetime, timedelta
 
 # 临时禁用 Redis 以避免兼容性问题
 try:
@@ -17,28 +21,114 @@ from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 内存缓存过期清理间隔（秒）
+MEMORY_CACHE_SWEEP_INTERVAL = 60
+# 频率草图计数器减半用的转换表
+_HALVE_TABLE = bytes(i >> 1 for i in range(256))
+# Redis SCAN 每次迭代的建议返回数量
+REDIS_SCAN_COUNT = 10000
+# Redis 批量删除每批的键数量
+REDIS_DELETE_BATCH_SIZE = 512
+# Redis 服务端统计（内存、键数）的缓存时间（秒）
+REDIS_STATS_TTL = 5.0
+
+
+def _serialize(value: Any) -> bytes:
+    """序列化缓存值（Redis存储用）"""
+    return orjson.dumps(
+        value, default=str, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+    )
+
+
+class _FrequencySketch:
+    """
+    Count-Min Sketch 访问频率估计（TinyLFU 准入策略用）
+
+    4 行计数器，每个计数器上限 15；累计写入达到容量的 10 倍时
+    所有计数减半，使频率随时间衰减
+    """
+    __slots__ = ("_rows", "_mask", "_additions", "_sample_size")
+    
+    _SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5)
+    
+    def __init__(self, capacity: int):
+        self._sample_size = max(10 * capacity, 16)
+        width = 1 << (self._sample_size - 1).bit_length()
+        self._rows = [bytearray(width) for _ in self._SEEDS]
+        self._mask = width - 1
+        self._additions = 0
+    
+    def _indexes(self, key: str):
+        h = hash(key)
+        return [((h * seed) & 0xFFFFFFFFFFFFFFFF) >> 32 & self._mask for seed in self._SEEDS]
+    
+    def increment(self, key: str):
+        """记录一次访问"""
+        for row, index in zip(self._rows, self._indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._rows = [row.translate(_HALVE_TABLE) for row in self._rows]
+            self._additions //= 2
+    
+    def frequency(self, key: str) -> int:
+        """估计访问频率"""
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+
+class _Entry:
+    """内存缓存条目"""
+    __slots__ = ("data", "expires_at", "size")
+    
+    def __init__(self, data: Any, expires_at: float, size: int):
+        self.data = data
+        self.expires_at = expires_at
+        self.size = size
+
 
 class CacheService:
     """统一缓存服务，支持Redis和内存缓存"""
     
     def __init__(self):
         self.redis_client = None
-        self.memory_cache: Dict[str, Dict] = {}
-        self.cache_stats = {
-            "hits": 0,
-            "misses": 0,
-            "sets": 0,
-            "deletes": 0
-        }
+        # 有界LRU内存缓存，条目的 expires_at 为 time.monotonic() 时间，size 为写入时估算的字节数
+        self.memory_cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.memory_cache_max_size = settings.CACHE_MAX_SIZE
+        # TinyLFU准入：缓存已满时，新键访问频率不低于LRU淘汰候选才写入
+        self._sketch = _FrequencySketch(self.memory_cache_max_size)
+        # 内存缓存占用字节数估算，随写入/删除增量维护
+        self._approx_bytes = 0
+        # 过期时间最小堆 (expires_at, key)，覆盖写入/删除留下的旧项在弹出时跳过
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._sweep_task: Optional[asyncio.Task] = None
+        # 统计计数器使用独立属性，避免每次操作的字典查找
+        self._hits = 0
+        self._misses = 0
+        self._sets = 0
+        self._deletes = 0
+        # Redis 服务端统计缓存 (获取时间, 统计数据)
+        self._redis_stats_cache: Optional[Tuple[float, Dict[str, Any]]] = None
         
+    @property
+    def cache_stats(self) -> Dict[str, int]:
+        """当前统计计数"""
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "sets": self._sets,
+            "deletes": self._deletes
+        }
+    
     async def initialize(self):
         """初始化缓存服务"""
         if REDIS_AVAILABLE and settings.REDIS_URL:
             try:
+                # 缓存值为orjson字节串，直接以bytes存取，跳过UTF-8解码
                 self.redis_client = aioredis.from_url(
                     settings.REDIS_URL,
-                    encoding="utf-8",
-                    decode_responses=True,
+                    decode_responses=False,
                     socket_connect_timeout=5,
                     socket_timeout=5
                 )
@@ -48,7 +138,11 @@ class CacheService:
             except Exception as e:
                 logger.warning(f"Redis连接失败，使用内存缓存: {str(e)}")
                 self.redis_client = None
-        else:
+        
+        # 未配置Redis或连接失败时都使用内存缓存，需要定期清理过期条目
+        if self.redis_client is None:
+            if self._sweep_task is None or self._sweep_task.done():
+                self._sweep_task = asyncio.create_task(self._sweep_expired_memory_cache())
             logger.info("📦 使用内存缓存服务")
     
     async def get(self, key: str) -> Optional[Any]:
@@ -58,24 +152,26 @@ class CacheService:
                 # 使用Redis
                 cached_data = await self.redis_client.get(key)
                 if cached_data:
-                    self.cache_stats["hits"] += 1
-                    return json.loads(cached_data)
+                    self._hits += 1
+                    return orjson.loads(cached_data)
             else:
                 # 使用内存缓存
-                cache_item = self.memory_cache.get(key)
-                if cache_item and cache_item["expires_at"] > datetime.utcnow():
-                    self.cache_stats["hits"] += 1
-                    return cache_item["data"]
-                elif cache_item:
+                self._sketch.increment(key)
+                entry = self.memory_cache.get(key)
+                if entry is not None:
+                    if entry.expires_at > time.monotonic():
+                        self.memory_cache.move_to_end(key)
+                        self._hits += 1
+                        return entry.data
                     # 过期删除
-                    del self.memory_cache[key]
+                    self._memory_remove(key)
             
-            self.cache_stats["misses"] += 1
+            self._misses += 1
             return None
             
         except Exception as e:
             logger.error(f"缓存获取失败 {key}: {str(e)}")
-            self.cache_stats["misses"] += 1
+            self._misses += 1
             return None
     
     async def set(
@@ -88,40 +184,86 @@ class CacheService:
         try:
             if self.redis_client:
                 # 使用Redis
-                cached_data = json.dumps(value, ensure_ascii=False, default=str)
+                cached_data = _serialize(value)
                 if expire:
                     await self.redis_client.setex(key, expire, cached_data)
                 else:
                     await self.redis_client.set(key, cached_data)
             else:
-                # 使用内存缓存
-                expires_at = datetime.utcnow() + timedelta(
-                    seconds=expire or settings.CACHE_EXPIRE_SECONDS
-                )
-                self.memory_cache[key] = {
-                    "data": value,
-                    "expires_at": expires_at
-                }
-                
-                # 清理过期缓存
-                await self._cleanup_expired_memory_cache()
+                # 使用内存缓存，被准入策略拒绝时不计入写入次数
+                if not self._memory_set(key, value, expire):
+                    return False
             
-            self.cache_stats["sets"] += 1
+            self._sets += 1
             return True
             
         except Exception as e:
             logger.error(f"缓存设置失败 {key}: {str(e)}")
             return False
     
+    async def mset_many(
+        self,
+        items: Dict[str, Any],
+        expire: Optional[int] = None
+    ) -> bool:
+        """批量设置缓存值（Redis模式下通过pipeline一次往返完成），全部写入成功时返回True"""
+        try:
+            if self.redis_client:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key, value in items.items():
+                    cached_data = _serialize(value)
+                    if expire:
+                        pipe.setex(key, expire, cached_data)
+                    else:
+                        pipe.set(key, cached_data)
+                await pipe.execute()
+                admitted = len(items)
+            else:
+                admitted = sum(self._memory_set(key, value, expire) for key, value in items.items())
+            
+            self._sets += admitted
+            return admitted == len(items)
+            
+        except Exception as e:
+            logger.error(f"批量缓存设置失败: {str(e)}")
+            return False
+    
+    def _memory_set(self, key: str, value: Any, expire: Optional[int] = None) -> bool:
+        """写入内存缓存，返回条目是否被准入"""
+        self._sketch.increment(key)
+        
+        if key not in self.memory_cache and len(self.memory_cache) >= self.memory_cache_max_size:
+            victim = next(iter(self.memory_cache))
+            if self._sketch.frequency(key) < self._sketch.frequency(victim):
+                # 新条目比淘汰候选更冷，拒绝写入以保护热点条目
+                return False
+            self._memory_remove(victim)
+        
+        expires_at = time.monotonic() + (expire or settings.CACHE_EXPIRE_SECONDS)
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        
+        # 覆盖写入时扣除旧条目的大小
+        self._memory_remove(key)
+        self.memory_cache[key] = _Entry(value, expires_at, size)
+        self._approx_bytes += size
+        heapq.heappush(self._expiry_heap, (expires_at, key))
+        return True
+    
+    def _memory_remove(self, key: str):
+        """从内存缓存删除条目并扣除其大小"""
+        entry = self.memory_cache.pop(key, None)
+        if entry is not None:
+            self._approx_bytes -= entry.size
+    
     async def delete(self, key: str) -> bool:
         """删除缓存"""
         try:
             if self.redis_client:
                 await self.redis_client.delete(key)
             else:
-                self.memory_cache.pop(key, None)
+                self._memory_remove(key)
             
-            self.cache_stats["deletes"] += 1
+            self._deletes += 1
             return True
             
         except Exception as e:
@@ -134,18 +276,26 @@ class CacheService:
             deleted_count = 0
             
             if self.redis_client:
-                keys = await self.redis_client.keys(pattern)
-                if keys:
-                    deleted_count = await self.redis_client.delete(*keys)
+                # SCAN 增量遍历避免 KEYS 阻塞Redis，UNLINK 在后台释放内存
+                batch = []
+                async for key in self.redis_client.scan_iter(match=pattern, count=REDIS_SCAN_COUNT):
+                    batch.append(key)
+                    if len(batch) >= REDIS_DELETE_BATCH_SIZE:
+                        deleted_count += await self.redis_client.unlink(*batch)
+                        batch = []
+                if batch:
+                    deleted_count += await self.redis_client.unlink(*batch)
             else:
-                # 内存缓存模式匹配
-                import fnmatch
-                keys_to_delete = [
-                    key for key in self.memory_cache.keys() 
-                    if fnmatch.fnmatch(key, pattern)
-                ]
+                # 内存缓存模式匹配，模式只翻译编译一次
+                prefix = pattern[:-1]
+                if pattern.endswith("*") and not any(c in prefix for c in "*?["):
+                    # 常见的 "prefix:*" 模式直接按前缀匹配
+                    keys_to_delete = [key for key in self.memory_cache if key.startswith(prefix)]
+                else:
+                    match = re.compile(fnmatch.translate(pattern)).match
+                    keys_to_delete = [key for key in self.memory_cache if match(key)]
                 for key in keys_to_delete:
-                    del self.memory_cache[key]
+                    self._memory_remove(key)
                 deleted_count = len(keys_to_delete)
             
             logger.info(f"清理缓存模式 {pattern}: 删除{deleted_count}项")
@@ -163,23 +313,31 @@ class CacheService:
             key_parts.append(f"{k}:{v}")
         
         key_string = "|".join(key_parts)
-        key_hash = hashlib.md5(key_string.encode()).hexdigest()
+        key_hash = hashlib.blake2b(key_string.encode(), digest_size=16).hexdigest()
         return f"{prefix}:{key_hash}"
     
     async def get_stats(self) -> Dict[str, Any]:
         """获取缓存统计信息"""
-        stats = self.cache_stats.copy()
+        stats = self.cache_stats
         
         if self.redis_client:
-            try:
-                info = await self.redis_client.info("memory")
-                stats.update({
-                    "type": "redis",
-                    "redis_memory_used": info.get("used_memory_human", "unknown"),
-                    "redis_keys": await self.redis_client.dbsize()
-                })
-            except:
-                stats["type"] = "redis_error"
+            now = time.monotonic()
+            cached = self._redis_stats_cache
+            if cached and now - cached[0] < REDIS_STATS_TTL:
+                # 服务端统计短时间复用，命中计数仍为实时值
+                stats.update(cached[1])
+            else:
+                try:
+                    info = await self.redis_client.info("memory")
+                    redis_stats = {
+                        "type": "redis",
+                        "redis_memory_used": info.get("used_memory_human", "unknown"),
+                        "redis_keys": await self.redis_client.dbsize()
+                    }
+                    self._redis_stats_cache = (now, redis_stats)
+                    stats.update(redis_stats)
+                except:
+                    stats["type"] = "redis_error"
         else:
             stats.update({
                 "type": "memory",
@@ -195,30 +353,45 @@ class CacheService:
         
         return stats
     
-    async def _cleanup_expired_memory_cache(self):
+    async def _sweep_expired_memory_cache(self):
+        """后台定期清理过期的内存缓存"""
+        while True:
+            await asyncio.sleep(MEMORY_CACHE_SWEEP_INTERVAL)
+            self._cleanup_expired_memory_cache()
+    
+    def _cleanup_expired_memory_cache(self):
         """清理过期的内存缓存"""
-        now = datetime.utcnow()
-        expired_keys = [
-            key for key, item in self.memory_cache.items()
-            if item["expires_at"] <= now
-        ]
+        now = time.monotonic()
+        heap = self._expiry_heap
+        expired_count = 0
+        
+        # 只弹出已到期的堆顶，代价与过期条目数成正比而非缓存大小
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            entry = self.memory_cache.get(key)
+            # 过期时间不一致说明该键已被重新写入，属于旧堆项
+            if entry is not None and entry.expires_at == expires_at:
+                self._memory_remove(key)
+                expired_count += 1
         
-        for key in expired_keys:
-            del self.memory_cache[key]
+        # 旧堆项过多时按现存条目重建
+        if len(heap) > 2 * len(self.memory_cache) + 1024:
+            self._expiry_heap = [(entry.expires_at, key) for key, entry in self.memory_cache.items()]
+            heapq.heapify(self._expiry_heap)
         
-        if expired_keys:
-            logger.debug(f"清理过期缓存: {len(expired_keys)}项")
+        if expired_count:
+            logger.debug(f"清理过期缓存: {expired_count}项")
     
     def _get_memory_cache_size(self) -> float:
         """估算内存缓存大小(MB)"""
-        try:
-            size_bytes = len(pickle.dumps(self.memory_cache))
-            return round(size_bytes / 1024 / 1024, 2)
-        except:
-            return 0.0
+        return round(self._approx_bytes / 1048576, 2)
     
     async def close(self):
         """关闭缓存连接"""
+        if self._sweep_task:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        
         if self.redis_client:
             await self.redis_client.close()
             logger.info("🔌 Redis连接已关闭")
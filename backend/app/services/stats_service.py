@@ -0,0 +1,96 @@
+import asyncio
+from typing import Any, Callable, Dict, List
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+# 每批最多处理的统计条目数
+STATS_BATCH_SIZE = 64
+# 凑批等待时间（秒）
+STATS_FLUSH_INTERVAL = 0.2
+
+
+async def drain_stats(queue: asyncio.Queue, session_factory: Callable[[], Session]):
+    """
+    后台消费合成统计队列，批量写入历史记录和用户用量
+
+    Args:
+        queue: 合成统计队列
+        session_factory: 数据库会话工厂
+    """
+    loop = asyncio.get_running_loop()
+
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + STATS_FLUSH_INTERVAL
+
+        # 在时间窗口内尽量凑满一批
+        while len(batch) < STATS_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            await asyncio.to_thread(_apply_stats, batch, session_factory)
+        except Exception as e:
+            logger.error(f"处理合成统计失败: {str(e)}")
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+
+def _apply_stats(batch: List[Dict[str, Any]], session_factory: Callable[[], Session]):
+    """在独立会话中应用一批统计，每批只提交一次"""
+    persisted = [item for item in batch if item["history"] is not None]
+    if persisted:
+        _write_records(persisted, session_factory)
+
+    for item in batch:
+        stats = {k: v for k, v in item.items() if k != "history"}
+        stats["timestamp"] = datetime.now(timezone.utc).isoformat()
+        logger.info(f"合成统计: {stats}")
+
+
+def _write_records(batch: List[Dict[str, Any]], session_factory: Callable[[], Session]):
+    """
+    写入一批历史记录并更新用户用量
+
+    同类对象的 add_all 由 SQLAlchemy 合并为多行 INSERT；
+    用量在数据库内原子累加，每个用户每批一条 UPDATE，多进程或并发批次不会丢失增量
+    """
+    db = session_factory()
+    try:
+        usage: Dict[int, int] = {}
+        for item in batch:
+            item["cost"] = item["history"].calculate_cost()
+            if item["user_id"]:
+                usage[item["user_id"]] = usage.get(item["user_id"], 0) + item["text_length"]
+
+        db.add_all(item["history"] for item in batch)
+        for user_id, delta in usage.items():
+            db.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(
+                    daily_usage=User.daily_usage + delta,
+                    monthly_usage=User.monthly_usage + delta
+                )
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -1,14 +1,19 @@
 import asyncio
+import contextlib
+import hashlib
 import uuid
 import tempfile
 import os
-import hashlib
-import json
-from typing import Optional, Dict, Any, List, AsyncGenerator
+import aiofiles
+import orjson
+from pathlib import Path
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Set, Tuple, AsyncGenerator
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 
-from app.services.volcano_client import volcano_client
+from app.services.volcano_client import volcano_client, resolve_voice_presets_path
 from app.services.cache_service import cache_service
 from app.schemas.tts import TTSRequest, TTSResponse, VoiceInfo, VoiceCategory, VoiceListResponse
 from app.core.config import settings
@@ -17,6 +22,28 @@ from app.utils.audio_utils import get_audio_duration, format_file_size
 logger = logging.getLogger(__name__)
 
 
+# 影响合成结果的请求字段，用于生成缓存键
+AUDIO_KEY_FIELDS = (
+    "text", "voice_id", "speed", "volume", "pitch",
+    "format", "emotion", "bitrate", "sample_rate"
+)
+
+
+@lru_cache(maxsize=1024)
+def _audio_cache_key(values: Tuple[Any, ...]) -> str:
+    """由按 AUDIO_KEY_FIELDS 排列的字段值计算缓存键"""
+    payload = dict(zip(AUDIO_KEY_FIELDS, values))
+    key_bytes = orjson.dumps(payload, default=str, option=orjson.OPT_SORT_KEYS)
+    return f"tts:{hashlib.sha256(key_bytes).hexdigest()}"
+
+
+# 音色配置文件路径（导入时解析一次）
+VOICE_CONFIG_PATH = resolve_voice_presets_path()
+
+# 已解析的音色配置，按 (路径, 修改时间) 缓存，文件未变化时重新加载无需再次解析
+_VOICE_DATA_BY_MTIME: Dict[Tuple[Path, int], Dict[str, Any]] = {}
+
+
 class TTSService:
     """TTS核心服务"""
     
@@ -24,11 +51,30 @@ class TTSService:
         self.volcano_client = volcano_client
         self.cache_service = cache_service
         self._voice_cache = None
+        self._audio_dir = settings.AUDIO_FILES_PATH.rstrip("/")
+        
+        # 正在进行中的合成任务（按缓存键合并相同的并发请求）
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # 后台写入任务的强引用，防止任务在完成前被回收
+        self._bg_tasks: Set[asyncio.Task] = set()
+        
+        # 音色过滤索引（音色数据加载后构建）
+        self._voice_by_id: Dict[str, VoiceInfo] = {}
+        self._category_index: Dict[str, VoiceCategory] = {}
+        self._by_category: Dict[str, Set[str]] = {}
+        self._by_language: Dict[str, Set[str]] = {}
+        self._emotion_voices: Set[str] = set()
+        self._search_tokens: Dict[str, str] = {}
+        
+        # 音色数据版本号，重新加载时递增以使列表缓存失效
+        self._voice_version = 0
+        self._statistics_payload: Dict[str, Any] = {}
         
     async def synthesize_text(
         self,
         request: TTSRequest,
-        user_id: Optional[str] = None
+        user_id: Optional[str] = None,
+        semaphore: Optional[asyncio.Semaphore] = None
     ) -> TTSResponse:
         """
         同步语音合成（带缓存优化）
@@ -36,104 +82,158 @@ class TTSService:
         Args:
             request: TTS请求参数
             user_id: 用户ID（可选）
+            semaphore: 合成并发限制（可选），缓存命中和合并的请求不占用名额
             
         Returns:
             TTS响应结果
         """
         try:
-            # 生成缓存键
-            cache_key = self.cache_service.generate_cache_key(
-                "tts",
-                text=request.text,
-                voice_id=request.voice_id,
-                speed=request.speed,
-                volume=request.volume,
-                pitch=request.pitch,
-                format=request.format,
-                emotion=request.emotion or "neutral"
-            )
+            # 按影响合成结果的字段生成内容哈希缓存键
+            cache_key = self.generate_cache_key(request)
             
-            # 检查缓存
-            cached_result = await self.cache_service.get(cache_key)
-            if cached_result:
-                # 生成新的请求ID，但保持其他数据
-                cached_result["request_id"] = str(uuid.uuid4())
-                cached_result["created_at"] = datetime.utcnow()
-                
-                # 重新构建file_path（缓存中不包含完整路径）
-                filename = f"tts_{cached_result['request_id']}.{cached_result.get('format', 'mp3')}"
-                cached_result["file_path"] = os.path.join(settings.AUDIO_FILES_PATH, filename)
-                
-                logger.info(f"缓存命中: {cache_key[:16]}... 跳过语音合成")
-                return TTSResponse(**cached_result)
-            
-            # 生成请求ID和文件路径
-            request_id = str(uuid.uuid4())
-            # 确保format是字符串格式，不是枚举对象
-            format_str = request.format.value if hasattr(request.format, 'value') else str(request.format)
-            filename = f"tts_{request_id}.{format_str}"
-            file_path = os.path.join(settings.AUDIO_FILES_PATH, filename)
+            # 检查缓存，需要保存历史时并行预取音色信息
+            if user_id:
+                cached_result, voice_info = await asyncio.gather(
+                    self.cache_service.get(cache_key),
+                    self.get_voice_info(request.voice_id),
+                    return_exceptions=True
+                )
+                if isinstance(cached_result, Exception) or not settings.CACHE_ENABLED:
+                    cached_result = None
+                if isinstance(voice_info, Exception):
+                    logger.warning(f"预取音色信息失败: {str(voice_info)}")
+                    voice_info = None
+            else:
+                cached_result = await self.cache_service.get(cache_key) if settings.CACHE_ENABLED else None
+                voice_info = None
             
-            logger.info(f"开始语音合成: {request_id}, 文本长度: {len(request.text)}")
+            if cached_result:
+                # 缓存只保存文件URL，确认音频文件仍在音频目录下才算命中
+                file_path = self._cached_audio_path(cached_result.get("file_url"))
+                if file_path is None:
+                    await self.cache_service.delete(cache_key)
+                else:
+                    # 生成新的请求ID和时间，不修改缓存中的数据
+                    response_data = dict(cached_result)
+                    response_data["request_id"] = uuid.uuid4().hex
+                    response_data["created_at"] = datetime.now(timezone.utc)
+                    response_data["file_path"] = file_path
+                    
+                    logger.info(f"缓存命中: {cache_key[:16]}... 跳过语音合成")
+                    return TTSResponse(**response_data)
             
-            # 调用火山引擎合成
-            result = await self.volcano_client.synthesize_to_file(
-                text=request.text,
-                voice_type=request.voice_id,
-                output_path=file_path,
-                speed_ratio=request.speed,
-                volume_ratio=request.volume,
-                pitch_ratio=request.pitch,
-                encoding=request.format,
-                emotion=request.emotion
-            )
+            # 相同内容正在合成时等待其结果，避免重复调用火山引擎
+            # 检查与登记之间没有await，在事件循环内是原子的
+            fut = self._inflight.get(cache_key)
+            if fut is not None:
+                logger.info(f"合并相同的合成请求: {cache_key[:16]}...")
+                return await asyncio.shield(fut)
             
-            # 获取音频时长
-            duration = None
+            fut = asyncio.get_running_loop().create_future()
+            self._inflight[cache_key] = fut
             try:
-                duration = await get_audio_duration(file_path)
-            except Exception as e:
-                logger.warning(f"获取音频时长失败: {str(e)}")
-            
-            # 生成文件URL
-            file_url = f"/audio/{filename}"
-            
-            # 构建响应
-            response = TTSResponse(
-                request_id=request_id,
-                text=request.text,
-                voice_id=request.voice_id,
-                file_path=file_path,
-                file_url=file_url,
-                file_size=result["file_size"],
-                duration=duration,
-                format=request.format,
-                synthesis_time=result["synthesis_time"],
-                created_at=datetime.utcnow(),
-                status="success"
-            )
-            
-            # 缓存结果（不包含敏感路径信息）
-            cache_data = response.dict()
-            cache_data.pop("file_path", None)  # 不缓存完整文件路径
-            await self.cache_service.set(
-                cache_key,
-                cache_data,
-                expire=settings.CACHE_EXPIRE_SECONDS
-            )
-            
-            # 保存历史记录（如果有用户ID）
-            if user_id:
-                await self._save_history(user_id, request, response)
-            
-            logger.info(f"语音合成完成: {request_id}, 文件大小: {format_file_size(result['file_size'])}")
-            return response
+                async with semaphore or contextlib.nullcontext():
+                    response = await self._synthesize_uncached(request, cache_key, user_id, voice_info)
+                fut.set_result(response)
+                return response
+            except BaseException as e:
+                # 取消或超时也要让等待者结束，异常统一转为普通Exception
+                fut.set_exception(e if isinstance(e, Exception) else Exception("合成任务已取消"))
+                # 标记异常已读取，没有等待者时不会触发未处理异常警告
+                fut.exception()
+                raise
+            finally:
+                self._inflight.pop(cache_key, None)
             
         except Exception as e:
             logger.error(f"语音合成失败: {str(e)}")
             raise Exception(f"语音合成失败: {str(e)}")
     
-    async def synthesize_stream(self, request: TTSRequest):
+    async def _synthesize_uncached(
+        self,
+        request: TTSRequest,
+        cache_key: str,
+        user_id: Optional[str] = None,
+        voice_info: Optional[VoiceInfo] = None
+    ) -> TTSResponse:
+        """调用火山引擎合成并写入缓存"""
+        # 生成请求ID和文件路径
+        request_id = uuid.uuid4().hex
+        # 确保format是字符串格式，不是枚举对象
+        format_str = getattr(request.format, "value", request.format)
+        filename = f"tts_{request_id}.{format_str}"
+        file_path = f"{self._audio_dir}/{filename}"
+        
+        logger.info(f"开始语音合成: {request_id}, 文本长度: {len(request.text)}")
+        
+        # 调用火山引擎合成
+        result = await self.volcano_client.synthesize_to_file(
+            text=request.text,
+            voice_type=request.voice_id,
+            output_path=file_path,
+            speed_ratio=request.speed,
+            volume_ratio=request.volume,
+            pitch_ratio=request.pitch,
+            encoding=request.format,
+            emotion=request.emotion
+        )
+        
+        # 获取音频时长
+        duration = None
+        try:
+            duration = await get_audio_duration(file_path)
+        except Exception as e:
+            logger.warning(f"获取音频时长失败: {str(e)}")
+        
+        # 生成文件URL
+        file_url = f"/audio/{filename}"
+        
+        # 缓存数据直接由本地变量构建（不包含敏感路径信息）
+        cache_data = {
+            "request_id": request_id,
+            "text": request.text,
+            "voice_id": request.voice_id,
+            "file_url": file_url,
+            "file_size": result["file_size"],
+            "duration": duration,
+            "format": format_str,
+            "synthesis_time": result["synthesis_time"],
+            "status": "success"
+        }
+        
+        # 构建响应（数据均来自内部，跳过校验；format保持枚举类型以免序列化告警）
+        response = TTSResponse.model_construct(
+            **{**cache_data, "format": request.format},
+            file_path=file_path,
+            created_at=datetime.now(timezone.utc)
+        )
+        
+        # 缓存与历史记录不影响响应结果，放到后台写入
+        if settings.CACHE_ENABLED:
+            self._spawn(self.cache_service.set(
+                cache_key,
+                cache_data,
+                expire=settings.CACHE_EXPIRE_SECONDS
+            ))
+        
+        # 保存历史记录（如果有用户ID）
+        if user_id:
+            self._spawn(self._save_history(user_id, request, response, voice_info))
+        
+        logger.info(f"语音合成完成: {request_id}, 文件大小: {format_file_size(result['file_size'])}")
+        return response
+    
+    def _spawn(self, coro) -> asyncio.Task:
+        """创建后台任务并保持引用直到完成"""
+        task = asyncio.create_task(coro)
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_tasks.discard)
+        return task
+    
+    async def synthesize_stream(
+        self,
+        request: TTSRequest
+    ):
         """
         流式语音合成
         
@@ -174,9 +274,15 @@ class TTSService:
         if self._voice_cache is None:
             await self._load_voice_data()
         
+        return self._build_voice_list(category, self._voice_version)
+    
+    @lru_cache(maxsize=8)
+    def _build_voice_list(self, category: Optional[str], version: int) -> VoiceListResponse:
+        """构建音色列表响应（按分类和数据版本缓存）"""
         # 如果指定了分类，过滤结果
         if category:
-            categories = [cat for cat in self._voice_cache["categories"] if cat.name == category]
+            category_obj = self._category_index.get(category)
+            categories = [category_obj] if category_obj else []
         else:
             categories = self._voice_cache["categories"]
         
@@ -188,6 +294,62 @@ class TTSService:
             emotion_voices=self._voice_cache["emotion_voices"]
         )
     
+    async def get_voice_statistics(self) -> Dict[str, Any]:
+        """
+        获取音色库统计信息（加载音色数据时预先计算）
+        
+        Returns:
+            统计信息字典
+        """
+        if self._voice_cache is None:
+            await self._load_voice_data()
+        
+        return self._statistics_payload
+    
+    async def get_voice_ids(
+        self,
+        category: Optional[str] = None,
+        language: Optional[str] = None,
+        emotion_support: Optional[bool] = None,
+        search: Optional[str] = None
+    ) -> Set[str]:
+        """
+        按过滤条件获取匹配的音色ID集合（基于预建索引）
+        
+        Args:
+            category: 音色分类
+            language: 语言（子串匹配，如 zh 匹配 zh-CN）
+            emotion_support: 是否支持情感
+            search: 搜索关键词，匹配名称、描述和标签
+            
+        Returns:
+            匹配的音色ID集合
+        """
+        if self._voice_cache is None:
+            await self._load_voice_data()
+        
+        if category:
+            voice_ids = set(self._by_category.get(category, ()))
+        else:
+            voice_ids = set(self._voice_by_id)
+        
+        if language:
+            voice_ids &= set().union(
+                *(ids for lang, ids in self._by_language.items() if language in lang)
+            )
+        
+        if emotion_support is not None:
+            if emotion_support:
+                voice_ids &= self._emotion_voices
+            else:
+                voice_ids -= self._emotion_voices
+        
+        if search:
+            search_text = search.lower()
+            voice_ids = {vid for vid in voice_ids if search_text in self._search_tokens[vid]}
+        
+        return voice_ids
+    
     async def get_voice_info(self, voice_id: str) -> Optional[VoiceInfo]:
         """
         获取指定音色的详细信息
@@ -201,12 +363,7 @@ class TTSService:
         if self._voice_cache is None:
             await self._load_voice_data()
         
-        for category in self._voice_cache["categories"]:
-            for voice in category.voices:
-                if voice.id == voice_id:
-                    return voice
-        
-        return None
+        return self._voice_by_id.get(voice_id)
     
     async def get_voice_name(self, voice_id: str) -> Optional[str]:
         """
@@ -231,33 +388,32 @@ class TTSService:
             logger.error(f"连接测试失败: {str(e)}")
             return False
     
+    async def reload_voice_data(self):
+        """重新查找音色配置文件并加载音色数据"""
+        global VOICE_CONFIG_PATH
+        VOICE_CONFIG_PATH = resolve_voice_presets_path()
+        await self._load_voice_data()
+        logger.info(f"重新加载了 {len(self._voice_by_id)} 个音色")
+    
     async def _load_voice_data(self):
         """从voice_presets_complete.json加载完整音色数据"""
         try:
-            # 查找voice_presets_complete.json文件
-            voice_config_path = None
-            
-            # 尝试几个可能的路径
-            possible_paths = [
-                os.path.join(os.getcwd(), "voice_presets_complete.json"),
-                os.path.join(os.path.dirname(__file__), "..", "..", "voice_presets_complete.json"),
-                os.path.join(os.path.dirname(__file__), "..", "..", "..", "voice_presets_complete.json"),
-                "voice_presets_complete.json"
-            ]
-            
-            for path in possible_paths:
-                if os.path.exists(path):
-                    voice_config_path = path
-                    break
+            voice_config_path = VOICE_CONFIG_PATH
             
             if not voice_config_path:
                 logger.warning("未找到voice_presets_complete.json文件，使用默认音色数据")
                 self._voice_cache = await self._get_fallback_voice_data()
+                self._build_voice_indexes()
                 return
             
-            # 加载JSON文件
-            with open(voice_config_path, 'r', encoding='utf-8') as f:
-                voice_data = json.load(f)
+            # 加载JSON文件（文件未修改时复用已解析的数据）
+            mtime_key = (voice_config_path, os.stat(voice_config_path).st_mtime_ns)
+            voice_data = _VOICE_DATA_BY_MTIME.get(mtime_key)
+            if voice_data is None:
+                async with aiofiles.open(voice_config_path, 'rb') as f:
+                    voice_data = orjson.loads(await f.read())
+                _VOICE_DATA_BY_MTIME.clear()
+                _VOICE_DATA_BY_MTIME[mtime_key] = voice_data
             
             logger.info(f"从 {voice_config_path} 加载音色数据")
             
@@ -270,9 +426,10 @@ class TTSService:
                 voices = []
                 
                 # 获取该分类下的音色
+                # 数据来自受控的配置文件，跳过Pydantic校验直接构建
                 if category_name in voice_presets:
                     for voice_data_item in voice_presets[category_name]:
-                        voice = VoiceInfo(
+                        voice = VoiceInfo.model_construct(
                             id=voice_data_item["id"],
                             name=voice_data_item["name"],
                             description=voice_data_item["description"],
@@ -283,7 +440,7 @@ class TTSService:
                         )
                         voices.append(voice)
                 
-                category = VoiceCategory(
+                category = VoiceCategory.model_construct(
                     name=category_name,
                     description=category_info["description"],
                     icon=category_info["icon"],
@@ -297,23 +454,68 @@ class TTSService:
             emotion_config = voice_data.get("emotion_config", {})
             emotion_voices = emotion_config.get("emotion_voices", [])
             
-            self._voice_cache = {
+            # 只读视图，防止下游代码意外修改共享的音色数据
+            self._voice_cache = MappingProxyType({
                 "categories": categories,
                 "emotion_voices": emotion_voices
-            }
+            })
             
             total_voices = sum(len(cat.voices) for cat in categories)
             logger.info(f"音色数据加载完成，共 {len(categories)} 个分类，{total_voices} 个音色")
             
+        except orjson.JSONDecodeError as e:
+            logger.error(f"音色数据文件格式错误: {str(e)}")
+            self._voice_cache = await self._get_fallback_voice_data()
         except Exception as e:
             logger.error(f"加载音色数据失败: {str(e)}")
             # 使用默认数据
             self._voice_cache = await self._get_fallback_voice_data()
+        
+        self._build_voice_indexes()
+    
+    def _build_voice_indexes(self):
+        """构建音色过滤索引（分类、语言、情感、搜索文本）和统计信息，并递增数据版本"""
+        self._voice_by_id = {}
+        self._category_index = {}
+        self._by_category = {}
+        self._by_language = {}
+        self._emotion_voices = set()
+        self._search_tokens = {}
+        
+        for category in self._voice_cache["categories"]:
+            self._category_index.setdefault(category.name, category)
+            category_ids = self._by_category.setdefault(category.name, set())
+            for voice in category.voices:
+                self._voice_by_id[voice.id] = voice
+                category_ids.add(voice.id)
+                self._by_language.setdefault(voice.language, set()).add(voice.id)
+                if voice.emotions:
+                    self._emotion_voices.add(voice.id)
+                # 预先小写化，分隔符避免跨字段误匹配
+                self._search_tokens[voice.id] = "\n".join(
+                    (voice.name, voice.description, " ".join(voice.tags))
+                ).lower()
+        
+        self._statistics_payload = {
+            "summary": {
+                "total_voices": sum(len(cat.voices) for cat in self._voice_cache["categories"]),
+                "total_categories": len(self._voice_cache["categories"]),
+                "emotion_voices": len(self._voice_cache["emotion_voices"]),
+                "supported_languages": 4,  # 中英日西
+                "supported_emotions": 9
+            },
+            "metadata": {
+                "version": "2.0.0",
+                "last_updated": "2024-06-04",
+                "source": "voice_presets_complete.json"
+            }
+        }
+        self._voice_version += 1
     
-    async def _get_fallback_voice_data(self) -> Dict[str, Any]:
+    async def _get_fallback_voice_data(self) -> MappingProxyType:
         """获取回退音色数据"""
         logger.warning("使用回退音色数据")
-        return {
+        return MappingProxyType({
             "categories": [
                 VoiceCategory(
                     name="通用音色",
@@ -334,35 +536,43 @@ class TTSService:
                 )
             ],
             "emotion_voices": []
-        }
+        })
     
     async def _save_history(
         self,
         user_id: str,
         request: TTSRequest,
-        response: TTSResponse
+        response: TTSResponse,
+        voice_info: Optional[VoiceInfo] = None
     ):
         """保存历史记录"""
         # 这里应该保存到数据库
         # 暂时记录日志
+        voice_name = voice_info.name if voice_info else request.voice_id
         logger.info(
             f"保存历史记录: 用户={user_id}, 请求={response.request_id}, "
-            f"文本长度={len(request.text)}, 音色={request.voice_id}"
+            f"文本长度={len(request.text)}, 音色={voice_name}"
         )
     
     def generate_cache_key(self, request: TTSRequest) -> str:
-        """生成缓存键"""
-        key_parts = [
-            request.text,
-            request.voice_id,
-            str(request.speed),
-            str(request.volume),
-            str(request.pitch),
-            request.format,
-            request.emotion or "neutral"
-        ]
-        key_string = "|".join(key_parts)
-        return f"tts:{hashlib.md5(key_string.encode()).hexdigest()}"
+        """根据影响合成结果的请求字段生成SHA-256缓存键（相同参数直接复用已计算的键）"""
+        values = tuple(getattr(request, k, None) for k in AUDIO_KEY_FIELDS)
+        try:
+            return _audio_cache_key(values)
+        except TypeError:
+            # 字段值不可哈希时无法记忆，直接计算
+            return _audio_cache_key.__wrapped__(values)
+    
+    def _cached_audio_path(self, file_url: Optional[str]) -> Optional[str]:
+        """由缓存的文件URL还原音频路径，文件已不在音频目录下时返回None"""
+        if not file_url:
+            return None
+        file_path = f"{self._audio_dir}/{os.path.basename(file_url)}"
+        audio_dir = os.path.realpath(self._audio_dir)
+        real_path = os.path.realpath(file_path)
+        if os.path.commonpath([audio_dir, real_path]) != audio_dir or not os.path.isfile(real_path):
+            return None
+        return file_path
 
 
 # 创建全局服务实例
@@ -1,19 +1,137 @@
 import asyncio
 import websockets
-import json
+import orjson
 import gzip
 import uuid
 import ssl
+import struct
 import tempfile
+import time
 import os
-from typing import AsyncGenerator, Optional, Dict, Any, List
+from pathlib import Path
+from typing import AsyncGenerator, Optional, Dict, Any, FrozenSet
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 请求负载超过该字节数时才进行gzip压缩，小负载压缩得不偿失
+PAYLOAD_COMPRESS_THRESHOLD = 2048
+
+# 响应协议头（4字节）及负载前缀的解析格式
+_HEADER = struct.Struct(">BBBB")
+_AUDIO_PREFIX = struct.Struct(">iI")  # 序列号、数据大小
+_ERROR_PREFIX = struct.Struct(">II")  # 错误码、消息大小
+_FRONTEND_PREFIX = struct.Struct(">I")  # 消息大小
+
+# 音色配置文件名及 backend 目录（backend/app/services -> backend）
+VOICE_PRESETS_FILENAME = "voice_presets_complete.json"
+_BACKEND_DIR = Path(__file__).resolve().parents[2]
+
+# 默认的支持情感的音色列表
+DEFAULT_EMOTION_VOICES = frozenset([
+    "zh_male_beijingxiaoye_emo_v2_mars_bigtts",
+    "zh_female_roumeinvyou_emo_v2_mars_bigtts",
+    "zh_male_yangguangqingnian_emo_v2_mars_bigtts",
+    "zh_female_meilinvyou_emo_v2_mars_bigtts",
+    "zh_female_shuangkuaisisi_emo_v2_mars_bigtts"
+])
+
+# WebSocket 单条消息上限与写缓冲高水位（字节）
+WS_MAX_MESSAGE_SIZE = 2 ** 22
+WS_WRITE_LIMIT = 2 ** 18
+
+
+def resolve_voice_presets_path() -> Optional[Path]:
+    """查找voice_presets_complete.json，优先使用 VOICE_PRESETS_PATH 配置"""
+    if settings.VOICE_PRESETS_PATH:
+        return Path(settings.VOICE_PRESETS_PATH)
+    
+    possible_paths = (
+        Path.cwd() / VOICE_PRESETS_FILENAME,
+        _BACKEND_DIR / VOICE_PRESETS_FILENAME,
+        _BACKEND_DIR.parent / VOICE_PRESETS_FILENAME
+    )
+    return next((path for path in possible_paths if path.exists()), None)
+
+
+@lru_cache(maxsize=1)
+def _load_emotion_voices() -> FrozenSet[str]:
+    """从voice_presets_complete.json加载支持情感的音色列表（只读取解析一次）"""
+    try:
+        voice_config_path = resolve_voice_presets_path()
+        
+        if not voice_config_path:
+            logger.warning("未找到voice_presets_complete.json文件，使用默认情感音色列表")
+            return DEFAULT_EMOTION_VOICES
+        
+        # 加载JSON文件
+        voice_data = orjson.loads(voice_config_path.read_bytes())
+        
+        # 获取支持情感的音色列表
+        emotion_config = voice_data.get("emotion_config", {})
+        emotion_voices = emotion_config.get("emotion_voices", [])
+        
+        if emotion_voices:
+            logger.info(f"从配置文件加载了 {len(emotion_voices)} 个支持情感的音色")
+            return frozenset(emotion_voices)
+        else:
+            logger.warning("配置文件中未找到情感音色配置，使用默认列表")
+            return DEFAULT_EMOTION_VOICES
+            
+    except Exception as e:
+        logger.error(f"加载情感音色配置失败: {str(e)}，使用默认列表")
+        return DEFAULT_EMOTION_VOICES
+
+
+@lru_cache(maxsize=256)
+def _request_template(
+    app_id: str,
+    access_token: str,
+    cluster: str,
+    voice_type: str,
+    encoding: str,
+    speed_ratio: float,
+    volume_ratio: float,
+    pitch_ratio: float,
+    emotion: Optional[str]
+) -> bytes:
+    """
+    预序列化的合成请求模板
+
+    同一音色参数的请求只有 uid、reqid、text 不同，模板中以占位符表示，
+    每次请求只需替换这三个字段
+    """
+    request_json = {
+        "app": {
+            "appid": app_id,
+            "token": access_token,
+            "cluster": cluster
+        },
+        "user": {
+            "uid": "__UID__"
+        },
+        "audio": {
+            "voice_type": voice_type,
+            "encoding": encoding,
+            "speed_ratio": speed_ratio,
+            "volume_ratio": volume_ratio,
+            "pitch_ratio": pitch_ratio,
+        },
+        "request": {
+            "reqid": "__REQID__",
+            "text": "__TEXT__",
+            "text_type": "plain",
+            "operation": "submit"
+        }
+    }
+    if emotion:
+        request_json["request"]["emotion"] = emotion
+    return orjson.dumps(request_json)
+
 
 class VolcanoTTSClient:
     """火山引擎TTS客户端（基于您原有代码改进）"""
@@ -25,8 +143,16 @@ class VolcanoTTSClient:
         self.host = settings.VOLCANO_HOST
         self.api_url = f"wss://{self.host}/api/v1/tts/ws_binary"
         
-        # 协议头（来自您的原代码）
-        self.default_header = bytearray(b'\x11\x10\x11\x00')
+        # 协议头（来自您的原代码），byte[2] 低4位为压缩方式：1=gzip，0=不压缩
+        self.default_header = b'\x11\x10\x11\x00'
+        self.uncompressed_header = b'\x11\x10\x10\x00'
+        
+        # SSL配置（所有连接共用同一上下文）
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+        # WebSocket 升级基于 HTTP/1.1，预先声明 ALPN 避免协商多余协议
+        self.ssl_context.set_alpn_protocols(["http/1.1"])
         
         # 消息类型映射
         self.MESSAGE_TYPES = {
@@ -36,59 +162,7 @@ class VolcanoTTSClient:
         }
         
         # 支持情感的音色列表（动态加载）
-        self.emotion_voices = self._load_emotion_voices()
-    
-    def _load_emotion_voices(self) -> List[str]:
-        """从voice_presets_complete.json加载支持情感的音色列表"""
-        try:
-            # 查找voice_presets_complete.json文件
-            voice_config_path = None
-            
-            # 尝试几个可能的路径
-            possible_paths = [
-                os.path.join(os.getcwd(), "voice_presets_complete.json"),
-                os.path.join(os.path.dirname(__file__), "..", "..", "voice_presets_complete.json"),
-                os.path.join(os.path.dirname(__file__), "..", "..", "..", "voice_presets_complete.json"),
-                "voice_presets_complete.json"
-            ]
-            
-            for path in possible_paths:
-                if os.path.exists(path):
-                    voice_config_path = path
-                    break
-            
-            if not voice_config_path:
-                logger.warning("未找到voice_presets_complete.json文件，使用默认情感音色列表")
-                return self._get_default_emotion_voices()
-            
-            # 加载JSON文件
-            with open(voice_config_path, 'r', encoding='utf-8') as f:
-                voice_data = json.load(f)
-            
-            # 获取支持情感的音色列表
-            emotion_config = voice_data.get("emotion_config", {})
-            emotion_voices = emotion_config.get("emotion_voices", [])
-            
-            if emotion_voices:
-                logger.info(f"从配置文件加载了 {len(emotion_voices)} 个支持情感的音色")
-                return emotion_voices
-            else:
-                logger.warning("配置文件中未找到情感音色配置，使用默认列表")
-                return self._get_default_emotion_voices()
-                
-        except Exception as e:
-            logger.error(f"加载情感音色配置失败: {str(e)}，使用默认列表")
-            return self._get_default_emotion_voices()
-    
-    def _get_default_emotion_voices(self) -> List[str]:
-        """获取默认的支持情感的音色列表"""
-        return [
-            "zh_male_beijingxiaoye_emo_v2_mars_bigtts",
-            "zh_female_roumeinvyou_emo_v2_mars_bigtts",
-            "zh_male_yangguangqingnian_emo_v2_mars_bigtts",
-            "zh_female_meilinvyou_emo_v2_mars_bigtts",
-            "zh_female_shuangkuaisisi_emo_v2_mars_bigtts"
-        ]
+        self.emotion_voices = _load_emotion_voices()
     
     async def synthesize_to_file(
         self,
@@ -117,62 +191,49 @@ class VolcanoTTSClient:
         Returns:
             包含合成结果信息的字典
         """
-        request_id = str(uuid.uuid4())
-        
-        # 构建JSON请求（基于您的原代码）
-        request_json = {
-            "app": {
-                "appid": self.app_id,
-                "token": self.access_token,
-                "cluster": self.cluster
-            },
-            "user": {
-                "uid": str(uuid.uuid4())
-            },
-            "audio": {
-                "voice_type": voice_type,
-                "encoding": encoding.value if hasattr(encoding, 'value') else str(encoding),
-                "speed_ratio": speed_ratio,
-                "volume_ratio": volume_ratio,
-                "pitch_ratio": pitch_ratio,
-            },
-            "request": {
-                "reqid": request_id,
-                "text": text,
-                "text_type": "plain",
-                "operation": "submit"
-            }
-        }
+        # 编码格式统一转为字符串（兼容枚举）
+        encoding_str = getattr(encoding, "value", encoding)
+        request_id = uuid.uuid4().hex
         
         # 添加情感参数（如果支持）
         if emotion and self.supports_emotion(voice_type):
-            request_json["request"]["emotion"] = emotion
             logger.info(f"为音色 {voice_type} 设置情感: {emotion}")
+        else:
+            emotion = None
+        
+        payload_bytes = self._build_payload(
+            text, voice_type, encoding_str, speed_ratio, volume_ratio, pitch_ratio, emotion, request_id
+        )
         
         try:
-            audio_data = bytearray()
-            start_time = datetime.utcnow()
-            
-            async for chunk in self._synthesize_stream(request_json):
-                audio_data.extend(chunk)
+            file_size = 0
+            created_at = datetime.now(timezone.utc).isoformat()
+            start_time = time.perf_counter()
             
-            # 保存文件
-            with open(output_path, 'wb') as f:
-                f.write(audio_data)
+            # 音频块到达即写入文件，不在内存中拼接完整音频
+            try:
+                with open(output_path, 'wb') as f:
+                    async for chunk in self._synthesize_stream(payload_bytes):
+                        f.write(chunk)
+                        file_size += len(chunk)
+            except BaseException:
+                # 合成失败时不留下不完整的文件
+                if os.path.exists(output_path):
+                    os.unlink(output_path)
+                raise
             
-            end_time = datetime.utcnow()
-            duration = (end_time - start_time).total_seconds()
+            duration = time.perf_counter() - start_time
             
             result = {
                 "request_id": request_id,
                 "file_path": output_path,
-                "file_size": len(audio_data),
+                "file_size": file_size,
                 "synthesis_time": duration,
-                "created_at": start_time.isoformat(),
+                "created_at": created_at,
                 "status": "success"
             }
             
-            logger.info(f"语音合成完成: {request_id}, 文件大小: {len(audio_data)} bytes")
+            logger.info(f"语音合成完成: {request_id}, 文件大小: {file_size} bytes")
             return result
             
         except Exception as e:
@@ -204,52 +265,64 @@ class VolcanoTTSClient:
         Yields:
             音频数据块
         """
-        request_json = {
-            "app": {
-                "appid": self.app_id,
-                "token": self.access_token,
-                "cluster": self.cluster
-            },
-            "user": {
-                "uid": str(uuid.uuid4())
-            },
-            "audio": {
-                "voice_type": voice_type,
-                "encoding": encoding.value if hasattr(encoding, 'value') else str(encoding),
-                "speed_ratio": speed_ratio,
-                "volume_ratio": volume_ratio,
-                "pitch_ratio": pitch_ratio,
-            },
-            "request": {
-                "reqid": str(uuid.uuid4()),
-                "text": text,
-                "text_type": "plain",
-                "operation": "submit"
-            }
-        }
+        # 编码格式统一转为字符串（兼容枚举）
+        encoding_str = getattr(encoding, "value", encoding)
         
         # 添加情感参数（如果支持）
         if emotion and self.supports_emotion(voice_type):
-            request_json["request"]["emotion"] = emotion
             logger.info(f"流式合成为音色 {voice_type} 设置情感: {emotion}")
+        else:
+            emotion = None
+        
+        payload_bytes = self._build_payload(
+            text, voice_type, encoding_str, speed_ratio, volume_ratio, pitch_ratio, emotion, uuid.uuid4().hex
+        )
         
-        async for chunk in self._synthesize_stream(request_json):
+        async for chunk in self._synthesize_stream(payload_bytes):
             yield chunk
     
-    async def _synthesize_stream(self, request_json: Dict[str, Any]) -> AsyncGenerator[bytes, None]:
+    def _build_payload(
+        self,
+        text: str,
+        voice_type: str,
+        encoding_str: str,
+        speed_ratio: float,
+        volume_ratio: float,
+        pitch_ratio: float,
+        emotion: Optional[str],
+        request_id: str
+    ) -> bytes:
+        """基于缓存的请求模板生成JSON请求体"""
+        template = _request_template(
+            self.app_id,
+            self.access_token,
+            self.cluster,
+            voice_type,
+            encoding_str,
+            speed_ratio,
+            volume_ratio,
+            pitch_ratio,
+            emotion
+        )
+        # text 最后替换，避免文本中恰好包含占位符时被误替换
+        return (
+            template
+            .replace(b'"__UID__"', orjson.dumps(uuid.uuid4().hex), 1)
+            .replace(b'"__REQID__"', orjson.dumps(request_id), 1)
+            .replace(b'"__TEXT__"', orjson.dumps(text), 1)
+        )
+    
+    async def _synthesize_stream(self, payload_bytes: bytes) -> AsyncGenerator[bytes, None]:
         """内部流式合成方法（基于您的原WebSocket代码）"""
         
         # 构建请求数据（来自您的原代码）
-        payload_bytes = str.encode(json.dumps(request_json))
-        payload_bytes = gzip.compress(payload_bytes)
-        full_client_request = bytearray(self.default_header)
-        full_client_request.extend((len(payload_bytes)).to_bytes(4, 'big'))
-        full_client_request.extend(payload_bytes)
-        
-        # SSL配置
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
+        if len(payload_bytes) > PAYLOAD_COMPRESS_THRESHOLD:
+            payload_bytes = gzip.compress(payload_bytes)
+            header = self.default_header
+        else:
+            header = self.uncompressed_header
+        # 协议头 + 4字节负载长度 + 负载，一次分配拼接成完整帧
+        full_client_request = b"".join((header, len(payload_bytes).to_bytes(4, 'big'), payload_bytes))
         
         # 请求头
         headers = {"Authorization": f"Bearer; {self.access_token}"}
@@ -259,8 +332,12 @@ class VolcanoTTSClient:
                 self.api_url,
                 additional_headers=headers,
                 ping_interval=None,
-                ssl=ssl_context,
-                close_timeout=settings.SYNTHESIS_TIMEOUT
+                ssl=self.ssl_context,
+                close_timeout=settings.SYNTHESIS_TIMEOUT,
+                max_size=WS_MAX_MESSAGE_SIZE,
+                write_limit=WS_WRITE_LIMIT,
+                # 音频本身已压缩，不协商 permessage-deflate
+                compression=None
             ) as websocket:
                 
                 # 发送请求
@@ -300,40 +377,40 @@ class VolcanoTTSClient:
                 return False, None
             
             # 解析协议头
-            protocol_version = response[0] >> 4
-            header_size = response[0] & 0x0f
-            message_type = response[1] >> 4
-            message_type_specific_flags = response[1] & 0x0f
-            serialization_method = response[2] >> 4
-            message_compression = response[2] & 0x0f
-            reserved = response[3]
+            b0, b1, b2, reserved = _HEADER.unpack_from(response)
+            protocol_version = b0 >> 4
+            header_size = b0 & 0x0f
+            message_type = b1 >> 4
+            message_type_specific_flags = b1 & 0x0f
+            message_compression = b2 & 0x0f
             
             header_length = header_size * 4
-            payload = response[header_length:]
             
-            logger.info(
-                f"Protocol: {protocol_version}, Header: {header_size}, "
-                f"Type: {message_type}, Flags: {message_type_specific_flags}"
-            )
+            # 每个音频块都会经过这里，逐块日志只在DEBUG级别输出
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                logger.debug(
+                    f"Protocol: {protocol_version}, Header: {header_size}, "
+                    f"Type: {message_type}, Flags: {message_type_specific_flags}"
+                )
             
             if message_type == 0xb:  # audio-only server response
                 if message_type_specific_flags == 0:
                     return False, None
                 
-                sequence_number = int.from_bytes(payload[:4], "big", signed=True)
-                payload_size = int.from_bytes(payload[4:8], "big", signed=False)
-                audio_data = payload[8:]
+                sequence_number, payload_size = _AUDIO_PREFIX.unpack_from(response, header_length)
+                audio_data = response[header_length + _AUDIO_PREFIX.size:]
                 
-                logger.info(f"序列号: {sequence_number}, 数据大小: {payload_size}")
+                if debug:
+                    logger.debug(f"序列号: {sequence_number}, 数据大小: {payload_size}")
                 
                 # 与GUI代码完全一致的逻辑：
                 # 序列号小于0表示这是最后一个包，返回(True, audio_data)
                 return sequence_number < 0, audio_data
             
             elif message_type == 0xf:  # error message
-                code = int.from_bytes(payload[:4], "big", signed=False)
-                msg_size = int.from_bytes(payload[4:8], "big", signed=False)
-                error_msg = payload[8:]
+                code, msg_size = _ERROR_PREFIX.unpack_from(response, header_length)
+                error_msg = response[header_length + _ERROR_PREFIX.size:]
                 
                 if message_compression == 1:
                     error_msg = gzip.decompress(error_msg)
@@ -343,11 +420,12 @@ class VolcanoTTSClient:
                 raise Exception(f"TTS API错误 {code}: {error_msg}")
             
             elif message_type == 0xc:  # frontend server response
-                msg_size = int.from_bytes(payload[:4], "big", signed=False)
-                payload = payload[4:]
+                msg_size, = _FRONTEND_PREFIX.unpack_from(response, header_length)
+                payload = response[header_length + _FRONTEND_PREFIX.size:]
                 if message_compression == 1:
                     payload = gzip.decompress(payload)
-                logger.info(f"前端消息: {payload}")
+                if debug:
+                    logger.debug(f"前端消息: {payload}")
             
             return False, None
             
@@ -381,7 +459,8 @@ class VolcanoTTSClient:
     
     def reload_emotion_voices(self):
         """重新加载支持情感的音色列表"""
-        self.emotion_voices = self._load_emotion_voices()
+        _load_emotion_voices.cache_clear()
+        self.emotion_voices = _load_emotion_voices()
         logger.info(f"重新加载了 {len(self.emotion_voices)} 个支持情感的音色")
 
 
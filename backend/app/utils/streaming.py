@@ -0,0 +1,39 @@
+import asyncio
+import logging
+
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    占用并发名额的流式响应
+
+    名额在响应结束时释放，无论正常结束、出错还是客户端断开，
+    即使音频流生成器一次都没有执行也会释放
+    """
+
+    def __init__(self, content, semaphore: asyncio.Semaphore, **kwargs):
+        super().__init__(content, **kwargs)
+        self._semaphore = semaphore
+        self._released = False
+
+    def release(self) -> None:
+        """释放并发名额（只释放一次）"""
+        if not self._released:
+            self._released = True
+            self._semaphore.release()
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+            # StreamingResponse不会关闭body_iterator，主动关闭以断开上游连接
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception as e:
+                    logger.warning(f"关闭音频流失败: {str(e)}")
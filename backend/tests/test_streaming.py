@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from app.utils.streaming import SlotStreamingResponse
+
+
+def _scope(spec_version: str) -> dict:
+    return {"type": "http", "asgi": {"version": "3.0", "spec_version": spec_version}}
+
+
+async def _take_slot() -> asyncio.Semaphore:
+    sem = asyncio.Semaphore(1)
+    await sem.acquire()
+    return sem
+
+
+def _audio_stream(started: list):
+    async def gen():
+        started.append(True)
+        yield b"chunk"
+    return gen()
+
+
+@pytest.mark.asyncio
+async def test_slot_released_when_client_disconnects_before_first_chunk():
+    """客户端在第一个音频块之前断开（监听断开消息的旧ASGI版本）"""
+    sem = await _take_slot()
+    started = []
+    response = SlotStreamingResponse(_audio_stream(started), semaphore=sem)
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # 响应头一直发不出去，生成器没有机会执行
+        await asyncio.Event().wait()
+
+    await asyncio.wait_for(response(_scope("2.0"), receive, send), timeout=5)
+
+    assert started == []
+    assert not sem.locked()
+
+
+@pytest.mark.asyncio
+async def test_slot_released_when_send_fails_before_first_chunk():
+    """客户端断开导致发送响应头失败（ASGI 2.4+）"""
+    sem = await _take_slot()
+    started = []
+    response = SlotStreamingResponse(_audio_stream(started), semaphore=sem)
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        raise OSError("client disconnected")
+
+    with pytest.raises(Exception):
+        await asyncio.wait_for(response(_scope("2.4"), receive, send), timeout=5)
+
+    assert started == []
+    assert not sem.locked()
+
+
+@pytest.mark.asyncio
+async def test_slot_released_once_after_complete_stream():
+    sem = await _take_slot()
+    started = []
+    response = SlotStreamingResponse(_audio_stream(started), semaphore=sem)
+    messages = []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await response(_scope("2.4"), receive, send)
+
+    assert started == [True]
+    assert messages[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+    assert sem._value == 1
@@ -1,21 +1,40 @@
 #!/usr/bin/env python3
 """
 补充生成失败音色的试听音频脚本
-增加延迟时间避免429频率限制错误
+限制并发数，遇到429频率限制时指数退避重试
 """
 import asyncio
 import aiohttp
-import json
+import orjson
+import os
+import random
+import sys
 import time
 from pathlib import Path
 from typing import List, Dict, Any
 
+# 可选：使用 uvloop 事件循环提升网络I/O吞吐
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # 配置
 API_BASE_URL = "http://localhost:8000"
 PREVIEW_TEXT = "我是您的专属声音，快来试试！"
 PREVIEW_DIR = "audio_files/previews"
-BATCH_SIZE = 1  # 每批只处理1个音色，减少频率
-DELAY_BETWEEN_REQUESTS = 5  # 每个请求间延迟5秒
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 下载音频时每次读取的字节数
+MAX_CONCURRENCY = 3  # 同时处理的音色数量
+MAX_RETRIES = 5  # 频率限制时的最大重试次数
+BACKOFF_BASE = 2  # 退避基础秒数
+BACKOFF_MAX = 60  # 单次退避最长秒数
+RESULTS_LOG = "generation_results.jsonl"  # 逐条追加的结果记录，中断时不丢失已完成的结果
+PART_SUFFIX = ".part"  # 下载中的临时文件后缀
+
+def clear_stale_parts():
+    """删除上次运行中断遗留的临时文件"""
+    for part_file in Path(PREVIEW_DIR).glob(f"*.mp3{PART_SUFFIX}"):
+        part_file.unlink(missing_ok=True)
 
 def load_failed_voices() -> List[str]:
     """从上次的生成报告中加载失败的音色ID"""
@@ -23,101 +42,176 @@ def load_failed_voices() -> List[str]:
     failed_voice_ids = []
     
     if report_file.exists():
-        with open(report_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(report_file, "rb") as f:
+            data = orjson.loads(f.read())
             for result in data.get("results", []):
                 if result.get("status") == "error":
                     failed_voice_ids.append(result["voice_id"])
     
     return failed_voice_ids
 
-async def get_voice_info(voice_id: str) -> Dict[str, Any]:
-    """根据voice_id获取音色信息"""
-    async with aiohttp.ClientSession() as session:
+class CatalogError(Exception):
+    """获取音色目录失败"""
+
+async def get_voice_catalog(session: aiohttp.ClientSession) -> Dict[str, Dict[str, Any]]:
+    """获取全部音色信息，按voice_id建立索引"""
+    try:
         async with session.get(f"{API_BASE_URL}/api/v1/voices/") as response:
-            if response.status == 200:
-                data = await response.json()
-                for category in data["categories"]:
-                    for voice in category["voices"]:
-                        if voice["id"] == voice_id:
-                            return {
-                                "voice_id": voice["id"],
-                                "name": voice["name"],
-                                "category": voice["category"],
-                                "description": voice["description"]
-                            }
-    return {"voice_id": voice_id, "name": "未知音色", "category": "未知", "description": ""}
+            if response.status != 200:
+                raise CatalogError(f"获取音色失败: HTTP {response.status}")
+            data = orjson.loads(await response.read())
+    except aiohttp.ClientError as e:
+        raise CatalogError(f"获取音色失败: {str(e)}")
+    
+    return {
+        voice["id"]: {
+            "voice_id": voice["id"],
+            "name": voice["name"],
+            "category": voice["category"],
+            "description": voice["description"]
+        }
+        for category in data["categories"]
+        for voice in category["voices"]
+    }
 
 async def synthesize_preview(session: aiohttp.ClientSession, voice: Dict[str, Any]) -> Dict[str, Any]:
     """为单个音色生成试听音频"""
     voice_id = voice["voice_id"]
     preview_file = Path(PREVIEW_DIR) / f"{voice_id}.mp3"
+    part_file = preview_file.with_name(preview_file.name + PART_SUFFIX)
     
-    # 如果文件已存在，跳过
     if preview_file.exists():
         print(f"⏭️  跳过 {voice['name']} (文件已存在)")
         return {"voice_id": voice_id, "status": "exists", "file": str(preview_file)}
     
+    # 独占创建临时文件：下载完成前不会出现在预览目录的正式文件名下，
+    # 并发运行时也不会重复生成同一音色
     try:
-        # 调用TTS合成接口
-        request_data = {
-            "text": PREVIEW_TEXT,
-            "voice_id": voice_id,
-            "format": "mp3",
-            "sample_rate": 24000,
-            "speed": 1.0,
-            "volume": 1.0
-        }
-        
-        print(f"🎵 正在生成 {voice['name']} ({voice['category']})...")
-        
-        async with session.post(
-            f"{API_BASE_URL}/api/v1/tts/synthesize",
-            json=request_data,
-            timeout=aiohttp.ClientTimeout(total=60)
-        ) as response:
-            if response.status == 200:
-                result = await response.json()
-                
-                # 下载音频文件
-                if result.get("file_url"):
-                    audio_url = f"{API_BASE_URL}{result['file_url']}"
-                    async with session.get(audio_url) as audio_response:
-                        if audio_response.status == 200:
-                            audio_data = await audio_response.read()
-                            
-                            # 保存到预览目录
-                            with open(preview_file, "wb") as f:
-                                f.write(audio_data)
-                            
-                            print(f"✅ {voice['name']} - {len(audio_data)} bytes")
-                            return {
-                                "voice_id": voice_id,
-                                "status": "success",
-                                "file": str(preview_file),
-                                "size": len(audio_data),
-                                "duration": result.get("duration", 0)
-                            }
-                        else:
-                            raise Exception(f"下载音频失败: {audio_response.status}")
+        fd = os.open(part_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        print(f"⏭️  跳过 {voice['name']} (正在生成)")
+        return {"voice_id": voice_id, "status": "exists", "file": str(preview_file)}
+    
+    completed = False
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # 调用TTS合成接口
+            request_data = {
+                "text": PREVIEW_TEXT,
+                "voice_id": voice_id,
+                "format": "mp3",
+                "sample_rate": 24000,
+                "speed": 1.0,
+                "volume": 1.0
+            }
+            
+            print(f"🎵 正在生成 {voice['name']} ({voice['category']})...")
+            
+            async with session.post(
+                f"{API_BASE_URL}/api/v1/tts/synthesize",
+                json=request_data,
+                timeout=aiohttp.ClientTimeout(total=60)
+            ) as response:
+                if response.status == 200:
+                    result = orjson.loads(await response.read())
+                    
+                    # 下载音频文件
+                    if result.get("file_url"):
+                        audio_url = f"{API_BASE_URL}{result['file_url']}"
+                        async with session.get(audio_url) as audio_response:
+                            if audio_response.status == 200:
+                                # 边下载边写入预览目录，内存中只保留一个数据块
+                                audio_size = 0
+                                async for chunk in audio_response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                    f.write(chunk)
+                                    audio_size += len(chunk)
+                                completed = True
+                                
+                                print(f"✅ {voice['name']} - {audio_size} bytes")
+                                return {
+                                    "voice_id": voice_id,
+                                    "status": "success",
+                                    "file": str(preview_file),
+                                    "size": audio_size,
+                                    "duration": result.get("duration", 0)
+                                }
+                            else:
+                                raise Exception(f"下载音频失败: {audio_response.status}")
+                    else:
+                        raise Exception("响应中没有音频URL")
+                elif response.status == 429:
+                    # 频率限制，由调用方退避后重试
+                    return {"voice_id": voice_id, "status": "rate_limited"}
                 else:
-                    raise Exception("响应中没有音频URL")
-            elif response.status == 429:
-                # 如果还是429错误，增加更长的延迟
-                print(f"⚠️  {voice['name']} 频率限制，等待更长时间...")
-                await asyncio.sleep(10)
-                raise Exception("频率限制，需要重试")
-            else:
-                error_text = await response.text()
-                raise Exception(f"合成失败 {response.status}: {error_text}")
-                
+                    error_text = await response.text()
+                    raise Exception(f"合成失败 {response.status}: {error_text}")
+                    
     except Exception as e:
         print(f"❌ {voice['name']} 失败: {str(e)}")
         return {"voice_id": voice_id, "status": "error", "error": str(e)}
+    finally:
+        if completed:
+            # 下载完整后再改为正式文件名
+            os.replace(part_file, preview_file)
+        else:
+            # 未成功生成时删除临时文件，下次运行可重新生成
+            part_file.unlink(missing_ok=True)
+
+def append_result(log_file, result: Dict[str, Any]):
+    """将单条结果追加到JSONL记录并立即落盘"""
+    log_file.write(orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE))
+    log_file.flush()
+
+async def process_voice(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    log_file,
+    catalog: Dict[str, Dict[str, Any]],
+    voice_id: str,
+    index: int,
+    total: int
+) -> Dict[str, Any]:
+    """在并发限制内处理单个音色，结果追加到JSONL记录"""
+    result = await retry_voice(session, semaphore, catalog, voice_id, index, total)
+    append_result(log_file, result)
+    return result
+
+async def retry_voice(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    catalog: Dict[str, Dict[str, Any]],
+    voice_id: str,
+    index: int,
+    total: int
+) -> Dict[str, Any]:
+    """在并发限制内处理单个音色，频率限制时带抖动指数退避重试"""
+    async with semaphore:
+        print(f"\n📦 处理 {index}/{total}: {voice_id}")
+        
+        # 获取音色信息
+        voice_info = catalog.get(voice_id)
+        
+        if not voice_info or not voice_info["name"]:
+            print(f"⚠️  无法找到音色信息: {voice_id}")
+            return {"voice_id": voice_id, "status": "error", "error": "音色不存在"}
+        
+        # 生成试听音频
+        for attempt in range(MAX_RETRIES):
+            result = await synthesize_preview(session, voice_info)
+            if result["status"] != "rate_limited":
+                return result
+            
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt + random.uniform(0, 1))
+            print(f"⚠️  {voice_info['name']} 频率限制，{delay:.1f} 秒后重试...")
+            await asyncio.sleep(delay)
+        
+        print(f"❌ {voice_info['name']} 失败: 频率限制，重试次数已用尽")
+        return {"voice_id": voice_id, "status": "error", "error": "频率限制，重试次数已用尽"}
 
 async def generate_missing_previews():
     """生成缺失的音色试听音频"""
     print("🔄 开始补充生成失败的音色试听音频...")
+    clear_stale_parts()
     
     # 获取失败的音色ID列表
     failed_voice_ids = load_failed_voices()
@@ -128,28 +222,18 @@ async def generate_missing_previews():
     
     print(f"📋 找到 {len(failed_voice_ids)} 个失败的音色需要重新生成")
     
-    results = []
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
     
+    results_log = Path(PREVIEW_DIR) / RESULTS_LOG
     async with aiohttp.ClientSession() as session:
-        for i, voice_id in enumerate(failed_voice_ids):
-            print(f"\n📦 处理 {i+1}/{len(failed_voice_ids)}: {voice_id}")
-            
-            # 获取音色信息
-            voice_info = await get_voice_info(voice_id)
-            
-            if not voice_info["name"] or voice_info["name"] == "未知音色":
-                print(f"⚠️  无法找到音色信息: {voice_id}")
-                results.append({"voice_id": voice_id, "status": "error", "error": "音色不存在"})
-                continue
-            
-            # 生成试听音频
-            result = await synthesize_preview(session, voice_info)
-            results.append(result)
-            
-            # 每个请求后延迟
-            if i < len(failed_voice_ids) - 1:
-                print(f"⏸️  等待 {DELAY_BETWEEN_REQUESTS} 秒...")
-                await asyncio.sleep(DELAY_BETWEEN_REQUESTS)
+        # 音色目录只获取一次
+        catalog = await get_voice_catalog(session)
+        
+        with open(results_log, "ab") as log_file:
+            results = await asyncio.gather(*[
+                process_voice(session, semaphore, log_file, catalog, voice_id, i + 1, len(failed_voice_ids))
+                for i, voice_id in enumerate(failed_voice_ids)
+            ])
     
     # 统计结果
     success_count = sum(1 for r in results if r.get("status") == "success")
@@ -164,8 +248,8 @@ async def generate_missing_previews():
     # 更新报告
     original_report_file = Path(PREVIEW_DIR) / "generation_report.json"
     if original_report_file.exists():
-        with open(original_report_file, "r", encoding="utf-8") as f:
-            original_data = json.load(f)
+        with open(original_report_file, "rb") as f:
+            original_data = orjson.loads(f.read())
         
         # 更新原始结果
         for new_result in results:
@@ -184,13 +268,23 @@ async def generate_missing_previews():
         original_data["last_updated"] = time.time()
         
         # 保存更新后的报告
-        with open(original_report_file, "w", encoding="utf-8") as f:
-            json.dump(original_data, f, ensure_ascii=False, indent=2)
+        original_report_file.write_bytes(
+            orjson.dumps(original_data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)
+        )
         
         print(f"📄 报告已更新: {original_report_file}")
         print(f"📁 总计音色: {len(all_results)}")
         print(f"✅ 总成功: {original_data['success_count']}")
         print(f"❌ 总失败: {original_data['error_count']}")
 
+def main():
+    """脚本入口，无法获取音色目录时给出提示并以非零状态退出"""
+    run = uvloop.run if uvloop is not None else asyncio.run
+    try:
+        run(generate_missing_previews())
+    except CatalogError as e:
+        print(f"❌ {e}，请检查后端服务: {API_BASE_URL}")
+        sys.exit(1)
+
 if __name__ == "__main__":
-    asyncio.run(generate_missing_previews()) 
\ No newline at end of file
+    main() 
\ No newline at end of file
@@ -5,136 +5,193 @@
 """
 import asyncio
 import aiohttp
-import json
+import orjson
 import os
+import sys
 import time
 from pathlib import Path
 from typing import List, Dict, Any
 
+# 可选：使用 uvloop 事件循环提升网络I/O吞吐
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # 配置
 API_BASE_URL = "http://localhost:8000"
 PREVIEW_TEXT = "我是您的专属声音，快来试试！"
 PREVIEW_DIR = "audio_files/previews"
-BATCH_SIZE = 5  # 每批处理的音色数量
-DELAY_BETWEEN_BATCHES = 2  # 批次间延迟秒数
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 下载音频时每次读取的字节数
+MAX_CONCURRENCY = 5  # 同时进行的合成请求数
+RESULTS_LOG = "generation_results.jsonl"  # 逐条追加的结果记录，中断时不丢失已完成的结果
+PART_SUFFIX = ".part"  # 下载中的临时文件后缀
 
 def ensure_preview_dir():
     """确保预览音频目录存在"""
     Path(PREVIEW_DIR).mkdir(parents=True, exist_ok=True)
     print(f"预览音频目录: {PREVIEW_DIR}")
 
+def clear_stale_parts():
+    """删除上次运行中断遗留的临时文件"""
+    for part_file in Path(PREVIEW_DIR).glob(f"*.mp3{PART_SUFFIX}"):
+        part_file.unlink(missing_ok=True)
+
+class CatalogError(Exception):
+    """获取音色目录失败"""
+
 async def get_all_voices() -> List[Dict[str, Any]]:
     """获取所有音色信息"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{API_BASE_URL}/api/v1/voices/") as response:
-            if response.status == 200:
-                data = await response.json()
-                voices = []
-                for category in data["categories"]:
-                    for voice in category["voices"]:
-                        voices.append({
-                            "voice_id": voice["id"],
-                            "name": voice["name"],
-                            "category": voice["category"],
-                            "description": voice["description"]
-                        })
-                print(f"获取到 {len(voices)} 个音色")
-                return voices
-            else:
-                raise Exception(f"获取音色失败: {response.status}")
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{API_BASE_URL}/api/v1/voices/") as response:
+                if response.status != 200:
+                    raise CatalogError(f"获取音色失败: HTTP {response.status}")
+                data = orjson.loads(await response.read())
+    except aiohttp.ClientError as e:
+        raise CatalogError(f"获取音色失败: {str(e)}")
+    
+    voices = []
+    for category in data["categories"]:
+        for voice in category["voices"]:
+            voices.append({
+                "voice_id": voice["id"],
+                "name": voice["name"],
+                "category": voice["category"],
+                "description": voice["description"]
+            })
+    print(f"获取到 {len(voices)} 个音色")
+    return voices
 
 async def synthesize_preview(session: aiohttp.ClientSession, voice: Dict[str, Any]) -> Dict[str, Any]:
     """为单个音色生成试听音频"""
     voice_id = voice["voice_id"]
     preview_file = Path(PREVIEW_DIR) / f"{voice_id}.mp3"
+    part_file = preview_file.with_name(preview_file.name + PART_SUFFIX)
     
-    # 如果文件已存在，跳过
     if preview_file.exists():
         print(f"⏭️  跳过 {voice['name']} (文件已存在)")
         return {"voice_id": voice_id, "status": "exists", "file": str(preview_file)}
     
+    # 独占创建临时文件：下载完成前不会出现在预览目录的正式文件名下，
+    # 并发运行时也不会重复生成同一音色
     try:
-        # 调用TTS合成接口
-        request_data = {
-            "text": PREVIEW_TEXT,
-            "voice_id": voice_id,
-            "format": "mp3",
-            "sample_rate": 24000,
-            "speed": 1.0,
-            "volume": 1.0
-        }
-        
-        async with session.post(
-            f"{API_BASE_URL}/api/v1/tts/synthesize",
-            json=request_data,
-            timeout=aiohttp.ClientTimeout(total=30)
-        ) as response:
-            if response.status == 200:
-                result = await response.json()
-                
-                # 下载音频文件
-                if result.get("file_url"):
-                    audio_url = f"{API_BASE_URL}{result['file_url']}"
-                    async with session.get(audio_url) as audio_response:
-                        if audio_response.status == 200:
-                            audio_data = await audio_response.read()
-                            
-                            # 保存到预览目录
-                            with open(preview_file, "wb") as f:
-                                f.write(audio_data)
-                            
-                            print(f"✅ {voice['name']} ({voice['category']}) - {len(audio_data)} bytes")
-                            return {
-                                "voice_id": voice_id,
-                                "status": "success",
-                                "file": str(preview_file),
-                                "size": len(audio_data),
-                                "duration": result.get("duration", 0)
-                            }
-                        else:
-                            raise Exception(f"下载音频失败: {audio_response.status}")
+        fd = os.open(part_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        print(f"⏭️  跳过 {voice['name']} (正在生成)")
+        return {"voice_id": voice_id, "status": "exists", "file": str(preview_file)}
+    
+    completed = False
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # 调用TTS合成接口
+            request_data = {
+                "text": PREVIEW_TEXT,
+                "voice_id": voice_id,
+                "format": "mp3",
+                "sample_rate": 24000,
+                "speed": 1.0,
+                "volume": 1.0
+            }
+            
+            async with session.post(
+                f"{API_BASE_URL}/api/v1/tts/synthesize",
+                json=request_data,
+                timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                if response.status == 200:
+                    result = orjson.loads(await response.read())
+                    
+                    # 下载音频文件
+                    if result.get("file_url"):
+                        audio_url = f"{API_BASE_URL}{result['file_url']}"
+                        async with session.get(audio_url) as audio_response:
+                            if audio_response.status == 200:
+                                # 边下载边写入预览目录，内存中只保留一个数据块
+                                audio_size = 0
+                                async for chunk in audio_response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                    f.write(chunk)
+                                    audio_size += len(chunk)
+                                completed = True
+                                
+                                print(f"✅ {voice['name']} ({voice['category']}) - {audio_size} bytes")
+                                return {
+                                    "voice_id": voice_id,
+                                    "status": "success",
+                                    "file": str(preview_file),
+                                    "size": audio_size,
+                                    "duration": result.get("duration", 0)
+                                }
+                            else:
+                                raise Exception(f"下载音频失败: {audio_response.status}")
+                    else:
+                        raise Exception("响应中没有音频URL")
                 else:
-                    raise Exception("响应中没有音频URL")
-            else:
-                error_text = await response.text()
-                raise Exception(f"合成失败 {response.status}: {error_text}")
-                
+                    error_text = await response.text()
+                    raise Exception(f"合成失败 {response.status}: {error_text}")
+                    
     except Exception as e:
         print(f"❌ {voice['name']} 失败: {str(e)}")
         return {"voice_id": voice_id, "status": "error", "error": str(e)}
+    finally:
+        if completed:
+            # 下载完整后再改为正式文件名
+            os.replace(part_file, preview_file)
+        else:
+            # 未成功生成时删除临时文件，下次运行可重新生成
+            part_file.unlink(missing_ok=True)
+
+def append_result(log_file, result: Dict[str, Any]):
+    """将单条结果追加到JSONL记录并立即落盘"""
+    log_file.write(orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE))
+    log_file.flush()
+
+async def bounded_synthesize(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    voice: Dict[str, Any]
+) -> Dict[str, Any]:
+    """在并发限制内生成单个音色的试听音频"""
+    async with semaphore:
+        return await synthesize_preview(session, voice)
 
 async def generate_all_previews():
     """批量生成所有音色的试听音频"""
     print("🎵 开始生成音色试听音频...")
     ensure_preview_dir()
+    clear_stale_parts()
     
     # 获取所有音色
     voices = await get_all_voices()
     
     results = []
-    total_batches = (len(voices) + BATCH_SIZE - 1) // BATCH_SIZE
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
     
+    # 始终保持 MAX_CONCURRENCY 个请求在途，完成一个补充一个
+    results_log = Path(PREVIEW_DIR) / RESULTS_LOG
     async with aiohttp.ClientSession() as session:
-        for i in range(0, len(voices), BATCH_SIZE):
-            batch = voices[i:i + BATCH_SIZE]
-            batch_num = i // BATCH_SIZE + 1
-            
-            print(f"\n📦 处理批次 {batch_num}/{total_batches} ({len(batch)} 个音色)")
-            
-            # 并行处理当前批次
-            tasks = [synthesize_preview(session, voice) for voice in batch]
-            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            for result in batch_results:
-                if isinstance(result, Exception):
-                    print(f"❌ 批次处理异常: {result}")
+        tasks = [
+            asyncio.create_task(bounded_synthesize(session, semaphore, voice))
+            for voice in voices
+        ]
+        
+        # 与补充生成脚本共用同一记录文件，只追加不覆盖
+        with open(results_log, "ab") as log_file:
+            for done_count, future in enumerate(asyncio.as_completed(tasks), 1):
+                try:
+                    result = await future
+                except Exception as e:
+                    print(f"❌ 处理异常: {e}")
                 else:
                     results.append(result)
-            
-            # 批次间延迟
-            if i + BATCH_SIZE < len(voices):
-                print(f"⏸️  等待 {DELAY_BETWEEN_BATCHES} 秒...")
-                await asyncio.sleep(DELAY_BETWEEN_BATCHES)
+                    append_result(log_file, result)
+                
+                if done_count % 10 == 0 or done_count == len(tasks):
+                    print(f"\n📦 进度 {done_count}/{len(tasks)}")
+    
+    # 结果按完成顺序到达，报告前恢复为音色目录顺序
+    voice_order = {voice["voice_id"]: i for i, voice in enumerate(voices)}
+    results.sort(key=lambda r: voice_order[r["voice_id"]])
     
     # 统计结果
     success_count = sum(1 for r in results if r.get("status") == "success")
@@ -149,17 +206,25 @@ async def generate_all_previews():
     
     # 保存结果报告
     report_file = Path(PREVIEW_DIR) / "generation_report.json"
-    with open(report_file, "w", encoding="utf-8") as f:
-        json.dump({
-            "timestamp": time.time(),
-            "total_voices": len(voices),
-            "success_count": success_count,
-            "exists_count": exists_count,
-            "error_count": error_count,
-            "results": results
-        }, f, ensure_ascii=False, indent=2)
+    report_file.write_bytes(orjson.dumps({
+        "timestamp": time.time(),
+        "total_voices": len(voices),
+        "success_count": success_count,
+        "exists_count": exists_count,
+        "error_count": error_count,
+        "results": results
+    }, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
     
     print(f"📄 详细报告已保存: {report_file}")
 
+def main():
+    """脚本入口，无法获取音色目录时给出提示并以非零状态退出"""
+    run = uvloop.run if uvloop is not None else asyncio.run
+    try:
+        run(generate_all_previews())
+    except CatalogError as e:
+        print(f"❌ {e}，请检查后端服务: {API_BASE_URL}")
+        sys.exit(1)
+
 if __name__ == "__main__":
-    asyncio.run(generate_all_previews()) 
\ No newline at end of file
+    main() 
\ No newline at end of file